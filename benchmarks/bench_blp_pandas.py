@@ -0,0 +1,60 @@
+#! /usr/bin/env python
+
+__doc__ = """
+Benchmark of the four entry points against the local FakeSession (no terminal needed)
+Reports rows/sec, latency and peak python memory (tracemalloc) per entry point
+
+python benchmarks/bench_blp_pandas.py --tickers 20 --hours 2 --fields 5
+"""
+
+import argparse
+import datetime
+import time
+import tracemalloc
+
+from blp_pandas import blp_pandas as bbg
+from blp_pandas.fake import FakeSession
+
+
+def run(name, function, *args, **kwargs):
+    # Timed and memory-traced separately since tracemalloc slows down the decoding
+    start = time.perf_counter()
+    df = function(*args, **kwargs)
+    latency = time.perf_counter() - start
+
+    tracemalloc.start()
+    function(*args, **kwargs)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    print('{:<14}{:>12,}{:>12.3f}{:>14,.0f}{:>14.1f}'.format(name, len(df), latency, len(df) / latency, peak_memory / 2**20))
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tickers', type=int, default=10)
+    parser.add_argument('--hours', type=int, default=1, help='length of the intraday range')
+    parser.add_argument('--years', type=int, default=5, help='length of the historical range')
+    parser.add_argument('--fields', type=int, default=5)
+    parser.add_argument('--rows-per-message', type=int, default=1000)
+    parser.add_argument('--max-in-flight', type=int, default=1)
+    args = parser.parse_args()
+
+    bbg.session_pool.close()
+    bbg.session_pool = bbg.SessionPool(session_factory=lambda options: FakeSession(options, rows_per_message=args.rows_per_message))
+
+    tickers = ['TICKER{} Equity'.format(i) for i in range(args.tickers)]
+    fields = ['FIELD_{}'.format(i) for i in range(args.fields)]
+    start = datetime.datetime(2018, 11, 22, 9, 0)
+    end = start + datetime.timedelta(hours=args.hours)
+
+    print('{:<14}{:>12}{:>12}{:>14}{:>14}'.format('entry point', 'rows', 'latency (s)', 'rows/sec', 'peak (MiB)'))
+    run('IntradayBar', bbg.IntradayBar, tickers, 'TRADE', start, end, 1, max_in_flight=args.max_in_flight)
+    run('IntradayTick', bbg.IntradayTick, tickers, ['BID', 'ASK'], start, end, max_in_flight=args.max_in_flight)
+    run('RefData', bbg.RefData, tickers, fields)
+    run('HistoData', bbg.HistoData, tickers, fields, datetime.datetime(2018 - args.years, 1, 1), datetime.datetime(2018, 1, 1))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#! /usr/bin/env python
+
+__doc__ = """
+Cost of importing blp_pandas and of creating a BLP object, against the local FakeSession (no terminal needed)
+Reports the median import time of a fresh interpreter, the heavy modules loaded by the import and the BLP() time
+
+python benchmarks/bench_import.py --runs 10 --check
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ('blpapi', 'pandas', 'numpy', 'pyarrow')
+
+IMPORT_SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+import blp_pandas.blp_pandas
+print(time.perf_counter() - start)
+print(','.join(name for name in {} if name in sys.modules))
+'''.format(HEAVY_MODULES)
+
+
+def time_import():
+    # Import time and heavy modules loaded, measured in a fresh interpreter
+    output = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT], check=True, capture_output=True, text=True).stdout
+    seconds, loaded = output.splitlines()
+    return float(seconds), [name for name in loaded.split(',') if name]
+
+
+def time_blp(runs):
+    # BLP() (session start included) and its first request on a FakeSession, then BLP() once the blpapi.Name constants exist
+    from blp_pandas import blp_pandas as bbg
+    from blp_pandas.fake import FakeSession
+
+    start = time.perf_counter()
+    with bbg.BLP(session_factory=FakeSession) as bloomberg:
+        bloomberg.get_refdata(['TICKER Equity'], ['PX_LAST'], None, None)
+    first = time.perf_counter() - start
+
+    timings = []
+    for run in range(runs):
+        start = time.perf_counter()
+        bbg.BLP(session_factory=FakeSession).stop()
+        timings.append(time.perf_counter() - start)
+    return first, statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--check', action='store_true', help='exit with 1 if the import loads a heavy module')
+    args = parser.parse_args()
+
+    results = [time_import() for run in range(args.runs)]
+    loaded = results[0][1]
+    print('{:<34}{:>10.1f} ms'.format('import blp_pandas.blp_pandas', 1000 * statistics.median(r[0] for r in results)))
+    print('{:<34}{:>13}'.format('heavy modules loaded', ', '.join(loaded) or 'none'))
+
+    first, median = time_blp(args.runs)
+    print('{:<34}{:>10.1f} ms'.format('BLP() + first request', 1000 * first))
+    print('{:<34}{:>10.3f} ms'.format('BLP()', 1000 * median))
+
+    if args.check and loaded:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
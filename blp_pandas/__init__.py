@@ -38,6 +38,14 @@ Features
 
 > The functions accept the overrides and any other parameters in a dictionary format
 
+> Bloomberg sessions are pooled (bbg.session_pool) and kept alive between calls
+
+> Real-time //blp/mktdata subscriptions into ring buffers (BLP.subscribe / BLP.snapshot)
+
+> asyncio versions of the entry points in blp_pandas.aio
+
+> Process pool versions of IntradayBar, IntradayTick and HistoData in blp_pandas.workers
+
 """
 
 __author__ = "Teddy Ambona"
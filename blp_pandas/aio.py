@@ -0,0 +1,506 @@
+import asyncio
+import datetime
+import itertools
+import threading
+import time
+from . import blp_pandas as bbg
+from .lazy import LazyName, lazy_import
+from .stats import logger
+
+blpapi = lazy_import('blpapi')
+
+__doc__ = """
+asyncio versions of the entry points, the requests of every call share one session in event handler mode
+
+from blp_pandas import aio
+
+df = await aio.IntradayBar('CAC FP Equity', 'TRADE', datetime(2018,11,22,9,0), datetime(2018,11,22,17,30), 1)
+
+list_df = await asyncio.gather(*[aio.RefData(ticker, 'PX_LAST') for ticker in tickers])
+
+The events are decoded by the blpapi dispatcher thread as they arrive and the future of a call is resolved on its
+event loop once the last response of its requests has been received: no polling and no thread per call.
+"""
+
+
+class SharedSession():
+
+    '''
+    Session of the BLP object of one call, the requests are sent on the session of the AsyncBLP
+    '''
+
+    def __init__(self, async_blp):
+        self.async_blp = async_blp
+        self.call = None
+
+    def start(self):
+        return self.async_blp.session_alive
+
+    def stop(self):
+        return None  # The session is shared with the other calls
+
+    def openService(self, name):
+        return self.async_blp.open_service(name)
+
+    def getService(self, name):
+        return self.async_blp.session.getService(name)
+
+    def sendRequest(self, request, identity=None, correlationId=None, eventQueue=None, requestLabel=''):
+        self.async_blp.calls[correlationId.value()] = self.call
+        return self.async_blp.session.sendRequest(request, correlationId=correlationId)
+
+    def cancel(self, correlationId):
+        return self.async_blp.session.cancel(correlationId)
+
+
+class AsyncCall():
+
+    '''
+    State of one call: a BLP object decoding the responses of its requests and the future waiting for its dataframe
+    '''
+
+    def __init__(self, async_blp, loop):
+        self.session = SharedSession(async_blp)
+        self.bloomberg = bbg.BLP(session_factory=lambda options: self.session)
+        self.bloomberg.correlation_ids = async_blp.correlation_ids  # Unique across the calls sharing the session
+        self.bloomberg.wait_for_slots = False  # Waiting for a slot would block the event loop, see AsyncBLP.fill_calls
+        self.session.call = self
+        self.loop = loop
+        self.future = loop.create_future()
+        self.requests = {}
+        self.max_in_flight = 1
+        self.retries = 0
+        self.assemble = None
+
+    def resolve(self, df_buffer=None, exception=None):
+        # Called from the dispatcher thread, the future is resolved on its event loop
+        def set_future():
+            if self.future.done():
+                return None  # Cancelled by the caller
+            if exception is not None:
+                self.future.set_exception(exception)
+            else:
+                self.future.set_result(df_buffer)
+            return None
+
+        if self.loop.is_closed():
+            return None  # Nobody can await the call anymore
+        self.loop.call_soon_threadsafe(set_future)
+        return None
+
+
+class AsyncBLP():
+
+    '''
+    Session in event handler mode shared by any number of concurrent calls
+    Each call has its own requests (routed back by correlation id) and max_in_flight applies per call
+    session_factory: Callable(session_options, event_handler) returning a session, e.g. fake.FakeSession
+    '''
+
+    SESSION_TERMINATED = LazyName("SessionTerminated")
+
+    def __init__(self, session_options=None, session_factory=None):
+        self.session_options = session_options
+        self.session_factory = session_factory
+        self.session = None
+        self.session_alive = False
+        self.services = set()
+        self.calls = {}  # Correlation id value -> AsyncCall of the requests in flight
+        self.correlation_ids = itertools.count(1)
+        self.lock = threading.RLock()  # Shared by the event loop threads and the dispatcher thread
+        self.waiting_calls = []  # Calls with requests queued, sent by fill_calls when the scheduler has a slot for them
+        self.retry_scheduled = False
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.stop()
+        return False
+
+    async def start(self):
+        # Starting the session and opening the service block, they are run in the default executor
+        await asyncio.get_running_loop().run_in_executor(None, self.connect)
+        return None
+
+    def connect(self):
+        if self.session_factory is not None:
+            self.session = self.session_factory(self.session_options, self.handle_event)
+        else:
+            self.session = blpapi.Session(self.session_options, self.handle_event)
+
+        self.session_alive = self.session.start()
+        if not self.session_alive:
+            raise ConnectionError('Failed to start the Bloomberg session')
+
+        self.open_service("//blp/refdata")
+        return None
+
+    async def stop(self):
+        # Stopping the session blocks, it is run in the default executor
+        await asyncio.get_running_loop().run_in_executor(None, self.disconnect)
+        return None
+
+    def disconnect(self):
+        if bbg.scheduler is not None:
+            bbg.scheduler.remove_listener(self.fill_calls)
+        if self.session is not None:
+            self.session.stop()
+        self.session_alive = False
+        self.services = set()
+        self.fail_calls(ConnectionError('The Bloomberg session has been stopped'))
+        return None
+
+    def open_service(self, service):
+        with self.lock:
+            if service not in self.services:
+                if not self.session.openService(service):
+                    logger.warning("Failed to open %s", service)
+                    return False
+                self.services.add(service)
+        return True
+
+    #***************************
+    # Calls
+    #***************************
+
+    async def get_intradaybar(self, security, event, start_date, end_date, barInterval, other_param=None, max_in_flight=1,
+                              window=None, retries=0, compact=False):
+        tickers = [security] if type(security) == str else security
+        call = AsyncCall(self, asyncio.get_running_loop())
+        requests = call.bloomberg.intradaybar_requests(tickers, event, start_date, end_date, barInterval, other_param, window,
+                                                       compact)
+        call.assemble = lambda: call.bloomberg.intraday_frame(tickers)
+        return await self.submit(call, requests, max_in_flight, retries)
+
+    async def get_intradaytick(self, security, list_events, start_date, end_date, condition_codes=True, other_param=None,
+                               max_in_flight=1, window=None, retries=0, compact=False):
+        tickers = [security] if type(security) == str else security
+        call = AsyncCall(self, asyncio.get_running_loop())
+        requests = call.bloomberg.intradaytick_requests(tickers, list_events, start_date, end_date, condition_codes,
+                                                        other_param, window, compact)
+        call.assemble = lambda: call.bloomberg.intraday_frame(tickers)
+        return await self.submit(call, requests, max_in_flight, retries)
+
+    async def get_refdata(self, security, fields, overrides=None, other_param=None, batch_size=None, max_fields=None,
+                          max_in_flight=1, retries=0, compact=False):
+        call = AsyncCall(self, asyncio.get_running_loop())
+        requests = call.bloomberg.refdata_requests(security, fields, overrides, other_param, batch_size, max_fields, compact)
+        call.assemble = lambda: call.bloomberg.refdata_frame(fields)
+        return await self.submit(call, requests, max_in_flight, retries)
+
+    async def get_bulkdata(self, security, fields, overrides=None, other_param=None, batch_size=None, max_fields=None,
+                           max_in_flight=1, retries=0):
+        call = AsyncCall(self, asyncio.get_running_loop())
+        requests = call.bloomberg.bulkdata_requests(security, fields, overrides, other_param, batch_size, max_fields)
+        call.assemble = call.bloomberg.bulkdata_frame
+        return await self.submit(call, requests, max_in_flight, retries)
+
+    async def get_histodata(self, security, fields, start_date, end_date, overrides=None, other_param=None, layout='long',
+                            compact=False):
+        call = AsyncCall(self, asyncio.get_running_loop())
+        requests = call.bloomberg.histodata_requests(security, fields, start_date, end_date, overrides, other_param, compact)
+        call.assemble = lambda: call.bloomberg.histodata_frame(layout)
+        return await self.submit(call, requests, 1, 0)
+
+    async def submit(self, call, requests, max_in_flight, retries):
+        call.requests = dict(requests)
+        call.max_in_flight = max_in_flight
+        call.retries = retries
+
+        with self.lock:
+            call.bloomberg.queue_requests(requests, max_in_flight)
+            if not (call.bloomberg.pending or call.bloomberg.queue):
+                self.complete(call)
+            self.wait_for_slots(call)
+
+        try:
+            return await call.future
+        except asyncio.CancelledError:
+            self.cancel(call)
+            raise
+
+    def cancel(self, call):
+        # The requests of a cancelled call are cancelled on the session
+        with self.lock:
+            call.bloomberg.queue.clear()
+            for value in list(call.bloomberg.pending):
+                self.calls.pop(value, None)
+                self.session.cancel(blpapi.CorrelationId(value))
+            call.bloomberg.pending.clear()
+            call.bloomberg.release_slots()
+            if call in self.waiting_calls:
+                self.waiting_calls.remove(call)
+        return None
+
+    #***************************
+    # Scheduler slots
+    #***************************
+
+    def wait_for_slots(self, call):
+        # Must be called with the lock held, the queued requests of the call are sent by fill_calls once they get a slot
+        if call.bloomberg.queue and (call not in self.waiting_calls):
+            self.waiting_calls.append(call)
+            if bbg.scheduler is not None:
+                bbg.scheduler.add_listener(self.fill_calls)
+        if call.bloomberg.queue and not call.bloomberg.pending:
+            self.retry_later(call)
+        return None
+
+    def fill_calls(self):
+        '''
+        Send the queued requests of the calls as the scheduler gives them slots, called after each release of a slot
+        (from any thread) and once the wait of the scheduler (backoff, token bucket) is over
+        '''
+        with self.lock:
+            for call in list(self.waiting_calls):
+                call.bloomberg.fill_in_flight()
+                if not call.bloomberg.queue:
+                    self.waiting_calls.remove(call)
+                elif not call.bloomberg.pending:
+                    self.retry_later(call)
+        return None
+
+    def retry_later(self, call):
+        # Must be called with the lock held, nothing of the call is in flight: only a release or the passing of time can
+        # give it a slot, the time is waited for on its event loop (one timer at a time)
+        slot_scheduler = bbg.scheduler
+        key, request = call.bloomberg.queue[0]
+        wait = slot_scheduler.time_to_slot(call.bloomberg.costs.get(key, 1), call.bloomberg.priority) if slot_scheduler else 0
+        if (wait is not None) and (not self.retry_scheduled):
+            self.retry_scheduled = True
+            call.loop.call_soon_threadsafe(call.loop.call_later, wait, self.retry)
+        return None
+
+    def retry(self):
+        self.retry_scheduled = False
+        self.fill_calls()
+        return None
+
+    #***************************
+    # Dispatcher thread
+    #***************************
+
+    def handle_event(self, event, session):
+        try:
+            if event.eventType() in (blpapi.Event.PARTIAL_RESPONSE, blpapi.Event.RESPONSE, blpapi.Event.REQUEST_STATUS):
+                self.process_event(event)
+            elif event.eventType() == blpapi.Event.SESSION_STATUS:
+                for msg in event:
+                    if msg.messageType() == self.SESSION_TERMINATED:
+                        self.session_alive = False
+                        self.fail_calls(ConnectionError('The Bloomberg session has been terminated'))
+        except Exception as e:
+            # An exception must not reach blpapi's dispatcher thread
+            logger.warning("Failed to process event: %s", e)
+        return None
+
+    def process_event(self, event):
+        with self.lock:
+            list_calls = []
+            for msg in event:
+                for correlation_id in msg.correlationIds():
+                    call = self.calls.get(correlation_id.value())
+                    if (call is not None) and (call not in list_calls):
+                        list_calls.append(call)
+
+            for call in list_calls:
+                bloomberg = call.bloomberg
+                bloomberg.count_event()
+
+                # Each BLP object ignores the messages of the requests of the other calls
+                if event.eventType() == blpapi.Event.REQUEST_STATUS:
+                    bloomberg.processRequestStatusEvent(event)
+                else:
+                    bloomberg.processResponseEvent(event)
+                    if event.eventType() == blpapi.Event.RESPONSE:
+                        bloomberg.complete_requests(event)
+
+                if event.eventType() != blpapi.Event.PARTIAL_RESPONSE:
+                    for msg in event:
+                        for correlation_id in msg.correlationIds():
+                            self.calls.pop(correlation_id.value(), None)
+
+                if not (bloomberg.pending or bloomberg.queue):
+                    self.complete(call)
+                self.wait_for_slots(call)
+
+        return None
+
+    def complete(self, call):
+        # Must be called with the lock held once no request of the call is in flight
+        bloomberg = call.bloomberg
+        if bloomberg.failed and (call.retries > 0) and self.session_alive:
+            call.retries -= 1
+            bloomberg.requeue_failed(call.requests, call.max_in_flight)
+            return None
+
+        try:
+            assembly_start = time.perf_counter()
+            call.resolve(bloomberg.finish(call.assemble(), assembly_start))
+        except Exception as e:
+            call.resolve(exception=e)
+        return None
+
+    def fail_calls(self, exception):
+        with self.lock:
+            # The calls with requests in flight and the ones whose requests are all still queued
+            list_calls = []
+            for call in itertools.chain(self.calls.values(), self.waiting_calls):
+                if call not in list_calls:
+                    list_calls.append(call)
+            self.calls.clear()
+            self.waiting_calls.clear()
+
+        for call in list_calls:
+            call.bloomberg.queue.clear()
+            call.bloomberg.release_slots()
+            call.resolve(exception=exception)
+        return None
+
+
+#***************************
+# Entry points
+#***************************
+
+async_blp = None  # AsyncBLP shared by the entry points, started by the first call
+async_blp_lock = threading.Lock()
+
+
+async def get_async_blp():
+    if (async_blp is None) or (not async_blp.session_alive):
+        await asyncio.get_running_loop().run_in_executor(None, connect_async_blp)
+    return async_blp
+
+
+def connect_async_blp():
+    # The concurrent first calls wait for the same session to start
+    global async_blp
+    with async_blp_lock:
+        if (async_blp is None) or (not async_blp.session_alive):
+            if async_blp is not None:
+                async_blp.disconnect()
+            bloomberg = AsyncBLP()
+            bloomberg.connect()
+            async_blp = bloomberg
+    return None
+
+
+async def IntradayBar(security, event, start_date, end_date, barInterval, other_param=None, max_in_flight=1, window=None,
+                      retries=0, compact=False):
+    '''
+    Same parameters and output as blp_pandas.IntradayBar (without stream), the requests of all the tickers are in flight together
+    '''
+    bbg.check_date_time(start_date)
+    bbg.check_date_time(end_date)
+    bbg.check_other_param(other_param)
+    bbg.check_max_in_flight(max_in_flight)
+    bbg.check_window(window)
+    bbg.check_compact(compact)
+
+    if (type(barInterval) != int) or (barInterval < 1):
+        raise ValueError('The bar interval has to be an integer greater than 1')
+
+    if (window != None) and (window % datetime.timedelta(minutes=barInterval) != datetime.timedelta(0)):
+        raise ValueError('The window has to be a multiple of the bar interval')
+
+    if (type(security) != str) and (type(security) != list):
+        raise ValueError('The security parameter has to be a string or a list')
+
+    return await (await get_async_blp()).get_intradaybar(security, event, start_date, end_date, barInterval, other_param,
+                                                         max_in_flight, window, retries, compact)
+
+
+async def IntradayTick(security, list_events, start_date, end_date, condition_codes=True, other_param=None, max_in_flight=1,
+                       window=None, retries=0, compact=False):
+    '''
+    Same parameters and output as blp_pandas.IntradayTick (without stream)
+    '''
+    bbg.check_date_time(start_date)
+    bbg.check_date_time(end_date)
+    bbg.check_other_param(other_param)
+    bbg.check_max_in_flight(max_in_flight)
+    bbg.check_window(window)
+    bbg.check_compact(compact)
+
+    if (type(security) != str) and (type(security) != list):
+        raise ValueError('The security parameter has to be a string or a list')
+
+    if (type(list_events) == str):
+        list_events = [list_events]
+
+    return await (await get_async_blp()).get_intradaytick(security, list_events, start_date, end_date, condition_codes,
+                                                          other_param, max_in_flight, window, retries, compact)
+
+
+async def RefData(security, fields, overrides=None, other_param=None, batch_size=None, max_fields=None, max_in_flight=1,
+                  retries=0, compact=False):
+    '''
+    Same parameters and output as blp_pandas.RefData (without cache and field_info)
+    '''
+    bbg.check_overrides(overrides)
+    bbg.check_other_param(other_param)
+    bbg.check_max_in_flight(max_in_flight)
+    bbg.check_compact(compact)
+
+    if (type(security) != str) and (type(security) != list):
+        raise ValueError('The security parameter has to be a string or a list')
+
+    if (type(fields) != str) and (type(fields) != list):
+        raise ValueError('The fields parameter has to be a string or a list')
+
+    security = [security] if type(security) == str else security
+    fields = [fields] if type(fields) == str else fields
+
+    return await (await get_async_blp()).get_refdata(security, fields, overrides, other_param, batch_size, max_fields,
+                                                     max_in_flight, retries, compact)
+
+
+async def BulkData(security, fields, overrides=None, other_param=None, batch_size=None, max_fields=None, max_in_flight=1,
+                   retries=0):
+    '''
+    Same parameters and output as blp_pandas.BulkData
+    '''
+    bbg.check_overrides(overrides)
+    bbg.check_other_param(other_param)
+    bbg.check_max_in_flight(max_in_flight)
+
+    if (type(security) != str) and (type(security) != list):
+        raise ValueError('The security parameter has to be a string or a list')
+
+    if (type(fields) != str) and (type(fields) != list):
+        raise ValueError('The fields parameter has to be a string or a list')
+
+    security = [security] if type(security) == str else security
+    fields = [fields] if type(fields) == str else fields
+
+    return await (await get_async_blp()).get_bulkdata(security, fields, overrides, other_param, batch_size, max_fields,
+                                                      max_in_flight, retries)
+
+
+async def HistoData(security, fields, start_date, end_date, overrides=None, other_param=None, layout='long', compact=False):
+    '''
+    Same parameters and output as blp_pandas.HistoData (without cache and field_info)
+    '''
+    bbg.check_date_time(start_date)
+    bbg.check_date_time(end_date)
+    bbg.check_overrides(overrides)
+    bbg.check_other_param(other_param)
+
+    if (type(security) != str) and (type(security) != list):
+        raise ValueError('The security parameter has to be a string or a list')
+
+    if (type(fields) != str) and (type(fields) != list):
+        raise ValueError('The fields parameter has to be a string or a list')
+
+    if layout not in ('long', 'wide'):
+        raise ValueError("The layout has to be 'long' or 'wide'")
+
+    bbg.check_compact(compact)
+
+    security = [security] if type(security) == str else security
+    fields = [fields] if type(fields) == str else fields
+
+    return await (await get_async_blp()).get_histodata(security, fields, start_date, end_date, overrides, other_param, layout,
+                                                       compact)
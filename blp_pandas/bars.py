@@ -0,0 +1,96 @@
+from .lazy import lazy_import
+
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
+
+__doc__ = """
+Bars of several intervals and event types computed locally from one pull of ticks
+
+from blp_pandas import blp_pandas as bbg
+from blp_pandas.bars import tick_bars
+
+df_ticks = bbg.IntradayTick(['CAC FP Equity'], ['TRADE', 'BID'], start_date, end_date, condition_codes=False)
+dict_bars = tick_bars(df_ticks, [1, 5, 15, 60], start_date)
+df_bars = dict_bars[('TRADE', 5)]  # Same columns as bbg.IntradayBar('CAC FP Equity', 'TRADE', start_date, end_date, 5)
+
+The ticks are sorted once by (ticker, type, time), each interval then only needs one pass over them.
+"""
+
+BAR_COLUMNS = ['open', 'high', 'low', 'close', 'volume', 'numEvents', 'value']
+
+
+def check_intervals(value):
+    if (type(value) != list) or (len(value) == 0):
+        raise ValueError('The intervals have to be a non empty list of integers greater than 1')
+    for interval in value:
+        if (type(interval) != int) or (interval < 1):
+            raise ValueError('The intervals have to be a non empty list of integers greater than 1')
+    return None
+
+
+def tick_bars(df_ticks, intervals, origin, events=None):
+    '''
+    Bars of every (event type, interval in minutes) from a dataframe of ticks shaped like IntradayTick's
+    (Multi-index time/ticker, 'type', 'value' and 'size' columns)
+    The bars start at origin + k * interval, their time is their start and the intervals without ticks are skipped
+    value is the sum of value * size of the ticks like in IntradayBarRequest responses
+    events lists the event types returned (the ones found in the ticks by default), empty frames for the ones without ticks
+
+    :return: dictionary (event type, interval) -> dataframe with the columns of IntradayBar
+    '''
+    times = df_ticks.index.get_level_values('time').values.astype('datetime64[ns]').view(np.int64)
+    ticker_codes, tickers = pd.factorize(df_ticks.index.get_level_values('ticker'))
+    type_codes, types = pd.factorize(df_ticks['type'])
+    values = df_ticks['value'].to_numpy(dtype=np.float64)
+    sizes = df_ticks['size'].to_numpy(dtype=np.int64)
+
+    # Sorted once, the bars of each interval are then contiguous runs of the ticks
+    order = np.lexsort((times, type_codes, ticker_codes))
+    times, ticker_codes, type_codes = times[order], ticker_codes[order], type_codes[order]
+    values, sizes = values[order], sizes[order]
+    notional = values * sizes
+
+    group_change = np.empty(len(times), dtype=bool)
+    group_change[:1] = True
+    group_change[1:] = (ticker_codes[1:] != ticker_codes[:-1]) | (type_codes[1:] != type_codes[:-1])
+
+    origin = np.datetime64(origin, 'ns').view(np.int64)
+
+    dict_bars = {}
+    for interval in intervals:
+        step = np.int64(interval * 60 * 10**9)  # Nanoseconds
+        buckets = (times - origin) // step
+
+        bar_change = group_change.copy()
+        bar_change[1:] |= buckets[1:] != buckets[:-1]
+        starts = np.flatnonzero(bar_change)
+        ends = np.append(starts[1:], len(times))[:len(starts)] - 1
+
+        bars = {'open': values[starts],
+                'high': np.maximum.reduceat(values, starts),
+                'low': np.minimum.reduceat(values, starts),
+                'close': values[ends],
+                'volume': np.add.reduceat(sizes, starts),
+                'numEvents': (ends - starts + 1).astype(np.int64),
+                'value': np.rint(np.add.reduceat(notional, starts)).astype(np.int64)}
+        bar_times = (origin + buckets[starts] * step).view('datetime64[ns]')
+        bar_tickers = ticker_codes[starts]
+        bar_types = type_codes[starts]
+
+        for event in (events if events != None else list(types)):
+            mask = bar_types == types.get_indexer([event])[0]
+            dict_bars[(event, interval)] = bar_frame(bar_times[mask], bar_tickers[mask], tickers,
+                                                     {name: array[mask] for name, array in bars.items()})
+
+    return dict_bars
+
+
+def bar_frame(bar_times, bar_tickers, tickers, bars):
+    # Same layout as BLP.get_intradaybar: Multi-index (time/ticker), one row per bar
+    time_codes, unique_times = pd.factorize(bar_times)
+    df_index = pd.MultiIndex(levels=[pd.DatetimeIndex(unique_times), list(tickers)],
+                             codes=[time_codes, bar_tickers],
+                             names=['time', 'ticker'],
+                             verify_integrity=False)
+
+    return pd.DataFrame(bars, index=df_index, columns=BAR_COLUMNS, copy=False)
@@ -1,7 +1,31 @@
-import blpapi
+import atexit
+import collections
+import concurrent.futures
+import contextlib
+import contextvars
+import copy
 import datetime
-import pandas as pd
-import numpy as np
+import functools
+import itertools
+import math
+import operator
+import queue
+import threading
+import time
+import weakref
+from .lazy import LazyName, lazy_import
+from .bars import check_intervals, tick_bars
+from .cache import FieldCache, HistoCache, RefDataCache, TickStore
+from .replay import Recorder
+from .sink import Sink, check_sink
+from .stats import RequestStats
+from . import scheduler as request_scheduler
+from . import stats
+
+# blpapi, pandas and numpy are imported on first use
+blpapi = lazy_import('blpapi')
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
 
 def check_date_time(value):
     if not isinstance(value, datetime.datetime):
@@ -20,46 +44,577 @@ def check_other_param(value):
             raise ValueError('The other_param argument has to be a dictionary')
     return None
 
+# //blp/apiflds datatype -> (typed getter, column dtype, missing value), the other datatypes are decoded with getElementValue
+# The integer fields are kept in float64 columns so that the missing values can be NaN
+NAN = float('nan')
+FIELD_TYPES = {'Double': ('getElementAsFloat', 'float64', NAN),
+               'Float': ('getElementAsFloat', 'float64', NAN),
+               'Float32': ('getElementAsFloat', 'float64', NAN),
+               'Float64': ('getElementAsFloat', 'float64', NAN),
+               'Decimal': ('getElementAsFloat', 'float64', NAN),
+               'Int32': ('getElementAsInteger', 'float64', NAN),
+               'Int64': ('getElementAsInteger', 'float64', NAN),
+               'String': ('getElementAsString', object, NAN),
+               'Char': ('getElementAsString', object, NAN),
+               'Enumeration': ('getElementAsString', object, NAN),
+               'Bool': ('getElementAsBool', object, NAN),
+               'Boolean': ('getElementAsBool', object, NAN),
+               'Date': ('getElementAsDatetime', 'datetime64[ns]', None)}
+
+def field_decoder(field, info=None):
+    '''
+    (name, getter(fieldData element), column dtype, missing value) of field, the getter and the dtype are chosen from
+    its //blp/apiflds metadata info when it is known, getElementValue and an 'auto' column otherwise
+    '''
+    name = blpapi.Name(field)
+    getter, dtype, missing = FIELD_TYPES.get(info['datatype'], (None, None, None)) if info else (None, None, None)
+    if getter is None:
+        getter, dtype, missing = 'getElementValue', 'auto', NAN
+    return name, operator.methodcaller(getter, name), dtype, missing
+
+class ColumnarBuilder():
+
+    '''
+    Columns of growable NumPy arrays appended to in place, the capacity doubles when the arrays are full
+    columns is a list of (name, dtype), the 'category' dtype stores int32 codes and the categories seen so far
+    (categories can be seeded with known values so that frames built separately share the same categories)
+    and the 'auto' dtype is a float64 array turned into an object array as soon as a non-numeric value is appended
+    to_frame() wraps views of the arrays so that no copy of the data is made
+    '''
+
+    def __init__(self, columns, categories=None, capacity=1024):
+        self.names = [name for name, dtype in columns]
+        self.dtypes = [dtype for name, dtype in columns]
+        self.size = 0
+        self.capacity = capacity
+        self.arrays = [np.empty(capacity, dtype={'category': np.int32, 'auto': np.float64}.get(dtype, dtype)) for dtype in self.dtypes]
+        self.auto = [j for j, dtype in enumerate(self.dtypes) if dtype == 'auto']  # Columns still in float64
+        self.categories = []
+        for j, dtype in enumerate(self.dtypes):
+            if dtype == 'category':
+                known = categories.get(self.names[j], []) if categories != None else []
+                self.categories.append((j, {value: code for code, value in enumerate(known)}))
+
+    def __len__(self):
+        return self.size
+
+    def grow(self):
+        self.capacity *= 2
+        for j, array in enumerate(self.arrays):
+            new_array = np.empty(self.capacity, dtype=array.dtype)
+            new_array[:self.size] = array[:self.size]
+            self.arrays[j] = new_array
+        return None
+
+    def append(self, row):
+        if self.size == self.capacity:
+            self.grow()
+
+        # Replace the categorical values by their codes
+        for j, codes in self.categories:
+            code = codes.get(row[j])
+            if code is None:
+                if (row[j] is None) or (row[j] != row[j]):
+                    code = -1  # Missing values (None/NaN) are not categories
+                else:
+                    code = codes[row[j]] = len(codes)
+            row[j] = code
+
+        # Turn the float64 'auto' columns into object columns when they receive something else
+        for j in self.auto:
+            if type(row[j]) not in (float, int):
+                self.arrays[j] = self.arrays[j].astype(object)
+                self.auto = [k for k in self.auto if k != j]
+
+        i = self.size
+        for array, value in zip(self.arrays, row):
+            array[i] = value
+        self.size += 1
+
+        return None
+
+    def clear(self):
+        self.size = 0
+        return None
+
+    def split_from(self, name, value):
+        '''
+        Move the trailing rows whose value in the (sorted) column name is greater or equal to value into a new builder
+        '''
+        j = self.names.index(name)
+        start = int(np.searchsorted(self.arrays[j][:self.size], value, side='left'))
+
+        tail = copy.copy(self)
+        tail.names, tail.dtypes, tail.auto = list(self.names), list(self.dtypes), list(self.auto)
+        tail.categories = [(k, dict(codes)) for k, codes in self.categories]
+        tail.size = self.size - start
+        tail.capacity = max(tail.size, 1024)
+        tail.arrays = []
+        for array in self.arrays:
+            tail_array = np.empty(tail.capacity, dtype=array.dtype)
+            tail_array[:tail.size] = array[start:self.size]
+            tail.arrays.append(tail_array)
+
+        self.size = start
+        return tail
+
+    def add_column(self, name, dtype='auto'):
+        '''
+        Add a float64, 'auto' or object column, the rows already appended get np.nan
+        '''
+        array = np.empty(self.capacity, dtype=np.float64 if dtype == 'auto' else dtype)
+        array[:self.size] = np.nan
+        if dtype == 'auto':
+            self.auto.append(len(self.arrays))
+        self.names.append(name)
+        self.dtypes.append(dtype)
+        self.arrays.append(array)
+        return None
+
+    def drop_from(self, name, value):
+        '''
+        Drop the trailing rows whose value in the (sorted) column name is greater or equal to value
+        '''
+        j = self.names.index(name)
+        self.size = int(np.searchsorted(self.arrays[j][:self.size], value, side='left'))
+        return None
+
+    def column(self, name):
+        j = self.names.index(name)
+        values = self.arrays[j][:self.size]
+
+        for k, codes in self.categories:
+            if k == j:
+                return pd.Categorical.from_codes(values, categories=list(codes))
+        return values
+
+    def ticker_codes(self, ticker):
+        # Codes/levels of the ticker index, a single ticker or the 'ticker' categorical column
+        if ticker is not None:
+            return np.zeros(self.size, dtype=np.int8), [ticker]
+
+        j = self.names.index('ticker')
+        for k, codes in self.categories:
+            if k == j:
+                return self.arrays[j][:self.size], list(codes)
+
+    def to_frame(self, ticker=None, index='time'):
+        '''
+        Returns a dataframe with a Multi-index (index/ticker) and one column per remaining array
+        '''
+        time_codes, times = pd.factorize(self.column(index))
+        ticker_codes, tickers = self.ticker_codes(ticker)
+        df_index = pd.MultiIndex(levels=[times, tickers],
+                                 codes=[time_codes, ticker_codes],
+                                 names=[index, 'ticker'],
+                                 verify_integrity=False)
+
+        columns = [name for name in self.names if name not in (index, 'ticker')]
+        data = {name: self.column(name) for name in columns}
+
+        return pd.DataFrame(data, index=df_index, columns=columns, copy=False)
+
+    def to_wide_frame(self, ticker=None, index='time'):
+        '''
+        Returns a dataframe indexed by index with (column, ticker) columns, the values are scattered into
+        one 2-D array per column instead of pivoting the long frame
+        '''
+        time_codes, times = pd.factorize(self.column(index), sort=True)
+        ticker_codes, tickers = self.ticker_codes(ticker)
+        columns = [name for name in self.names if name not in (index, 'ticker')]
+
+        blocks = []
+        for name in columns:
+            values = self.arrays[self.names.index(name)][:self.size]
+            block = np.full((len(times), len(tickers)), np.nan, dtype=np.float64 if values.dtype.kind in 'fiu' else object)
+            block[time_codes, ticker_codes] = values
+            blocks.append(pd.DataFrame(block, index=times, columns=tickers, copy=False))
+
+        df_buffer = pd.concat(blocks, axis=1, keys=columns, names=[None, 'ticker'])
+        df_buffer.index.name = index
+
+        return df_buffer
+
+
+class RingBuffer():
+
+    '''
+    Fixed-size buffer of the latest updates of a subscription: a 'time' array and one float64 array per field
+    Every update is written twice (at i and i + size) so that the latest n updates are always contiguous and
+    snapshot() wraps views of the arrays without copying them. A snapshot of the latest n updates stays valid
+    until size - n more updates have been written, copy=True returns a frame that does not change.
+    '''
+
+    def __init__(self, fields, size=10000):
+        self.fields = fields
+        self.size = size
+        self.count = 0  # Updates written since the creation of the buffer
+        self.times = np.empty(2 * size, dtype='datetime64[ns]')
+        self.arrays = [np.full(2 * size, np.nan, dtype=np.float64) for field in fields]
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def append(self, time_update, values):
+        '''
+        values holds one value per field (np.nan for the fields missing from the update)
+        '''
+        with self.lock:
+            i = self.count % self.size
+            self.times[i] = self.times[i + self.size] = time_update
+            for array, value in zip(self.arrays, values):
+                array[i] = array[i + self.size] = value
+            self.count += 1
+        return None
+
+    def snapshot(self, n=None, copy=False):
+        '''
+        Returns a dataframe of the latest n updates (all the updates kept by default) indexed by time
+        '''
+        with self.lock:
+            n = len(self) if n == None else min(n, len(self))
+            end = (self.count - 1) % self.size + self.size + 1 if self.count else self.size
+            data = {field: array[end - n:end] for field, array in zip(self.fields, self.arrays)}
+            index = pd.DatetimeIndex(self.times[end - n:end], name='time', copy=copy)
+
+            return pd.DataFrame(data, index=index, columns=self.fields, copy=copy)
+
+
+def check_window(value):
+    if value != None:
+        if (type(value) != datetime.timedelta) or (value <= datetime.timedelta(0)):
+            raise ValueError('The window has to be a positive timedelta')
+    return None
+
+def split_time_range(start_date, end_date, window):
+    '''
+    Split start_date..end_date into consecutive windows of at most window, returns a list of (start, end)
+    '''
+    if window == None:
+        return [(start_date, end_date)]
+
+    windows = []
+    window_start = start_date
+    while window_start < end_date:
+        window_end = min(window_start + window, end_date)
+        windows.append((window_start, window_end))
+        window_start = window_end
+
+    return windows or [(start_date, end_date)]
+
+def split_list(values, size):
+    # Consecutive chunks of at most size values (one chunk if size is None)
+    if size == None:
+        return [values]
+    return [values[i:i + size] for i in range(0, len(values), size)]
+
+def union_categories(list_df_buffer):
+    '''
+    Categorical columns are given the union of their categories in all the frames so that pd.concat keeps them categorical
+    '''
+    for column in list_df_buffer[0].columns if list_df_buffer else []:
+        if not isinstance(list_df_buffer[0][column].dtype, pd.CategoricalDtype):
+            continue
+        categories = list(dict.fromkeys(itertools.chain.from_iterable(df[column].cat.categories for df in list_df_buffer)))
+        for df in list_df_buffer:
+            if list(df[column].cat.categories) != categories:
+                df[column] = df[column].cat.set_categories(categories)
+    return list_df_buffer
+
+def concat_frames(list_df_buffer):
+    # pandas drops the attrs that differ between the frames, the stats of the requests are added up and the failed
+    # tickers gathered instead
+    df_buffer = pd.concat(union_categories(list_df_buffer))
+    df_buffer.attrs['stats'] = RequestStats.merge([df.attrs.get('stats') for df in list_df_buffer])
+    df_buffer.attrs['failed'] = sorted(set(itertools.chain.from_iterable(df.attrs.get('failed', []) for df in list_df_buffer)))
+    return df_buffer
+
+def check_compact(value):
+    if (type(value) != bool) and (value != 'float32'):
+        raise ValueError("The compact parameter has to be a boolean or 'float32'")
+    return None
+
+def compact_frame(df_buffer, float32=False):
+    '''
+    Integer columns are downcast to the smallest integer dtype holding their values and, if float32 is True,
+    float64 columns are stored as float32. The frame is modified in place and returned.
+    '''
+    for column in df_buffer.columns:
+        values = df_buffer[column]
+        if values.dtype.kind in 'iu':
+            df_buffer[column] = pd.to_numeric(values, downcast='integer')
+        elif float32 and (values.dtype == np.float64):
+            df_buffer[column] = values.astype(np.float32)
+    return df_buffer
+
+def check_field_info(value):
+    if (value != None) and (type(value) != bool) and (not isinstance(value, FieldCache)):
+        raise ValueError('The field_info parameter has to be a boolean or a FieldCache')
+    return None
+
+def check_max_in_flight(value):
+    if (type(value) != int) or (value < 1):
+        raise ValueError('The max_in_flight parameter has to be an integer greater than 1')
+    return None
+
+def check_resume(value):
+    if (type(value) != int) or (value < 0):
+        raise ValueError('The resume parameter has to be a positive integer or 0')
+    return None
+
+def check_store(value):
+    if (value != None) and (type(value) != str) and (not isinstance(value, TickStore)):
+        raise ValueError('The store has to be a directory path or a TickStore')
+    return None
+
+def write_sink(sink, frames, **options):
+    '''
+    Write the frames (e.g. the chunks of a stream) into sink, a directory path (Sink(sink, **options)) or a Sink,
+    returns the paths of the files written
+    '''
+    sink = Sink(sink, **options) if type(sink) == str else sink
+    with sink:
+        for df_buffer in frames:
+            sink.write(df_buffer)
+    return sink.files
+
+WAITS = ('blocking', 'callback')
+
+def check_wait(value):
+    if value not in WAITS:
+        raise ValueError("The wait parameter has to be 'blocking' or 'callback'")
+    return None
+
+def check_timeout(value):
+    if (value != None) and ((type(value) not in (int, float)) or (value <= 0)):
+        raise ValueError('The timeouts have to be a number of seconds greater than 0')
+    return None
+
+# Deadline of the requests sent in the current thread (or task), see deadline()
+current_deadline = contextvars.ContextVar('deadline', default=None)
+
+class Deadline():
+
+    '''
+    Overall timeout (from the start of the block) and per-request timeout of the requests sent in a deadline() block
+    cancel() stops the requests sent under the deadline from any thread, the calls waiting for them raise CancelledError
+    '''
+
+    def __init__(self, timeout=None, request_timeout=None):
+        self.timeout = timeout
+        self.request_timeout = request_timeout
+        self.expires = time.monotonic() + timeout if timeout != None else None
+        self.cancelled = False
+        self.lock = threading.Lock()
+        self.waiting = weakref.WeakSet()  # BLP objects that sent requests under the deadline
+
+    def register(self, bloomberg):
+        with self.lock:
+            self.waiting.add(bloomberg)
+        return None
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            waiting = list(self.waiting)
+        for bloomberg in waiting:
+            bloomberg.wake()
+        return None
+
+@contextlib.contextmanager
+def deadline(timeout=None, request_timeout=None):
+    '''
+    The calls made in the block (in the current thread or task) raise TimeoutError once timeout seconds have passed
+    since the start of the block, and each request still in flight request_timeout seconds after it was sent is
+    cancelled and failed (it is sent again if the call has retries). Yields the Deadline, see Deadline.cancel
+    '''
+    check_timeout(timeout)
+    check_timeout(request_timeout)
+    token = current_deadline.set(Deadline(timeout, request_timeout))
+    try:
+        yield current_deadline.get()
+    finally:
+        current_deadline.reset(token)
+
 class BLP():
 
-    def __init__(self):
+    # blpapi.Name constants shared by all the instances, see lazy.LazyName
+    BAR_DATA = LazyName("barData")
+    BAR_TICK_DATA = LazyName("barTickData")
+    CATEGORY = LazyName("category")
+    CLOSE = LazyName("close")
+    DATATYPE = LazyName("datatype")
+    DATE = LazyName("date")
+    FIELD_DATA = LazyName("fieldData")
+    FIELD_ERROR = LazyName("fieldError")
+    FIELD_ID = LazyName("fieldId")
+    FIELD_INFO = LazyName("fieldInfo")
+    FTYPE = LazyName("ftype")
+    HIGH = LazyName("high")
+    ID = LazyName("id")
+    LOW = LazyName("low")
+    MESSAGE = LazyName("message")
+    MNEMONIC = LazyName("mnemonic")
+    NUM_EVENTS = LazyName("numEvents")
+    OPEN = LazyName("open")
+    REASON = LazyName("reason")
+    REQUEST_FAILURE = LazyName("RequestFailure")
+    RESPONSE_ERROR = LazyName("responseError")
+    SECURITY_DATA = LazyName("securityData")
+    SECURITY = LazyName("security")
+    SESSION_TERMINATED = LazyName("SessionTerminated")
+    TIME = LazyName("time")
+    VALUE = LazyName("value")
+    VOLUME = LazyName("volume")
+    TICK_DATA = LazyName("tickData")
+    TICK_SIZE = LazyName("size")
+    TYPE = LazyName("type")
+
+    MARKET_DATA_EVENTS = LazyName("MarketDataEvents")
+    SUBSCRIPTION_FAILURE = LazyName("SubscriptionFailure")
+    SUBSCRIPTION_TERMINATED = LazyName("SubscriptionTerminated")
+
+    max_wait = 1.0  # Seconds waited at most in nextEvent with wait='blocking', so that cancel() is noticed
+
+    def __init__(self, session_options=None, session_factory=None, record=None, wait='blocking'):
+        '''
+        wait='blocking' waits for the events in session.nextEvent until the nearest deadline, wait='callback' starts
+        the session with an event handler and waits on the queue it fills (cancel() then wakes the caller up at once)
+        '''
+        check_wait(wait)
+        self.session_options = session_options
+        # Callable(session_options) returning a session, e.g. fake.FakeSession, called with (session_options, event_handler)
+        # when wait='callback'
+        self.session_factory = session_factory
+        self.wait = wait
+        self.events = None  # Queue of the events received by the event handler with wait='callback'
+        self.recorder = Recorder(record) if record != None else None  # Log of the events received, see replay.ReplaySession
+        self.correlation_ids = itertools.count(1)  # Never reused so that late messages cannot be misrouted
+        self.wait_for_slots = True  # False: the requests that cannot take a slot at once stay queued, see aio.AsyncBLP
+        self.scheduled = {}  # Correlation id value -> RequestScheduler holding a slot for the request
+        self.reset()
+
+        self.session = None
+        self.unreported_start = 0.0  # Time spent starting sessions not reported in the stats of a request yet
+        self.start()
+
+        # Subscriptions are served by their own session read by a background thread, see subscribe()
+        self.subscription_session = None
+        self.subscription_thread = None
+        self.subscriptions = {}  # Correlation id value -> (ticker, field names, RingBuffer)
+        self.buffers = {}  # Ticker -> RingBuffer
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.unsubscribe()
+        self.stop()
+        if self.recorder is not None:
+            self.recorder.close()
+        return False
+
+    def reset(self):
+        '''
+        Clear the state left by the previous request so that the object (and its session) can be reused
+        '''
         self.boo_getIntradayBar = False
         self.boo_getIntradayTick = False
         self.boo_getRefData = False
         self.boo_getHistoData = False
-        self.dictData = {}
-        self.list_df_buffer = []  # Used to store the temporary dataframes
-
-        self.BAR_DATA = blpapi.Name("barData")
-        self.BAR_TICK_DATA = blpapi.Name("barTickData")
-        self.CATEGORY = blpapi.Name("category")
-        self.CLOSE = blpapi.Name("close")
-        self.FIELD_DATA = blpapi.Name("fieldData")
-        self.FIELD_ID = blpapi.Name("fieldId")
-        self.HIGH = blpapi.Name("high")
-        self.LOW = blpapi.Name("low")
-        self.MESSAGE = blpapi.Name("message")
-        self.NUM_EVENTS = blpapi.Name("numEvents")
-        self.OPEN = blpapi.Name("open")
-        self.RESPONSE_ERROR = blpapi.Name("responseError")
-        self.SECURITY_DATA = blpapi.Name("securityData")
-        self.SECURITY = blpapi.Name("security")
-        self.SESSION_TERMINATED = blpapi.Name("SessionTerminated")
-        self.TIME = blpapi.Name("time")
-        self.VALUE = blpapi.Name("value")
-        self.VOLUME = blpapi.Name("volume")
-        self.TICK_DATA = blpapi.Name("tickData")
-        self.TICK_SIZE = blpapi.Name("size")
-        self.TYPE = blpapi.Name("type")
-
-        # Create a Session
-        self.session = blpapi.Session()
-
-        # Start a Session
-        if not self.session.start():
+        self.boo_getFieldInfo = False
+        self.boo_getBulkData = False
+        self.dictData = {}  # Key of a request -> data decoded for it
+        self.pending = {}  # Correlation id value -> key of the requests in flight
+        self.queue = collections.deque()  # (key, request) waiting for a free slot
+        self.max_in_flight = 1
+        self.failed = set()  # Keys of the requests that came back with an error
+        self.throttled = set()  # Keys of the requests that failed with a LIMIT error
+        self.costs = {}  # Key of a request -> its data points for the scheduler (1 by default)
+        self.priority = 'interactive'
+        self.release_slots()
+        self.windows = []  # Time windows of the intraday requests, keys are (ticker index, window index)
+        self.request_factories = {}  # Key of an intraday request -> callable(start, end) building it, see resume_requests
+        self.key_tickers = {}  # Key of a request -> tickers it asks for, see failed_tickers
+        self.stats = RequestStats()  # Timings and counts of the request, see stats.py
+        self.compact = False  # False, True or 'float32', see compact_frame
+        self.deadline = None  # Deadline the requests are sent under, see deadline()
+        self.expires = {}  # Correlation id value -> time.monotonic() at which the request in flight times out
+        self.cancel_requested = False
+        return None
+
+    def new_session(self, event_handler=None):
+        if self.session_factory is not None:
+            if event_handler is not None:
+                return self.session_factory(self.session_options, event_handler)
+            return self.session_factory(self.session_options)
+        elif event_handler is not None:
+            return blpapi.Session(self.session_options, event_handler)
+        elif self.session_options is None:
+            return blpapi.Session()
+        return blpapi.Session(self.session_options)
+
+    def start(self):
+        # Create a Session, its event handler queues the events for next_event with wait='callback'
+        if self.wait == 'callback':
+            events = self.events = queue.Queue()
+            self.session = self.new_session(lambda event, session: events.put(event))
+        else:
+            self.session = self.new_session()
+
+        self.services = set()  # Services opened on the current session
+
+        # Start a Session (the time taken is reported with the next request)
+        start_time = time.perf_counter()
+        self.session_alive = self.session.start()
+        self.unreported_start += time.perf_counter() - start_time
+        if not self.session_alive:
             print("Failed to start session.")
-            return None
 
+        return self.session_alive
+
+    def stop(self):
+        if self.session is not None:
+            self.session.stop()
+        self.session_alive = False
+        self.release_slots()
+        self.services = set()
+        return None
+
+    def reconnect(self):
+        self.stop()
+        return self.start()
+
+    def is_alive(self):
+        '''
+        The session is flagged as dead when it fails to start or when a SessionTerminated event is received
+        '''
+        return self.session_alive
+
+    def check_session(self):
+        '''
+        Read the events received while the session was idle (without waiting) so that a session terminated in the
+        meantime is flagged as dead, the other events are late messages of the requests that are over
+        '''
+        while self.session_alive:
+            if self.wait == 'callback':
+                try:
+                    event = self.events.get_nowait()
+                except queue.Empty:
+                    break
+                if event is None:
+                    continue  # Wake-up of a call that is over
+            else:
+                event = self.session.tryNextEvent()
+                if event is None:
+                    break
+
+            if event.eventType() == blpapi.Event.SESSION_STATUS:
+                for msg in event:
+                    if msg.messageType() == self.SESSION_TERMINATED:
+                        self.session_alive = False
+        return self.session_alive
 
     def printErrorInfo(self, leadingStr, errorInfo):
         print ("%s%s (%s)" % (leadingStr, errorInfo.getElementAsString(self.CATEGORY),
@@ -67,9 +622,16 @@ class BLP():
         return None
 
     def check_service(self, service):
-        # Open service to get historical data from
-        if not (self.session.openService(service)):
+        # Open service to get historical data from (only once per session)
+        if service in self.services:
+            return None
+
+        start_time = time.perf_counter()
+        if self.session.openService(service):
+            self.services.add(service)
+        else:
             print("Failed to open {}".format(service))
+        self.stats.add('open_service', time.perf_counter() - start_time)
         return None
 
     def set_other_param(self, other_param, request):
@@ -91,76 +653,507 @@ class BLP():
 
         return request
 
-    def eventLoop(self, session):
-        done = False
+    def send_request(self, request, key):
+        '''
+        Send a request tagged with its own CorrelationId so that the messages received can be routed back to key
+        '''
+        correlation_id = blpapi.CorrelationId(next(self.correlation_ids))
+        self.pending[correlation_id.value()] = key
+        if self.stats.sent_at is None:
+            self.stats.sent_at = time.perf_counter()
+        self.stats.requests += 1
+        if (self.deadline is not None) and (self.deadline.request_timeout != None):
+            self.expires[correlation_id.value()] = time.monotonic() + self.deadline.request_timeout
+        self.session.sendRequest(request, correlationId=correlation_id)
+        if self.recorder is not None:
+            self.recorder.record_request(correlation_id)
+        return correlation_id
+
+    def send_requests(self, requests, max_in_flight=1, retries=0, resume=0):
+        '''
+        Send a list of (key, request) keeping at most max_in_flight of them outstanding, then wait for all the responses
+        The requests that failed are sent again (alone) up to retries times
+        If the session terminates, the unfinished intraday requests are resumed on a new session up to resume times
+        '''
+        self.queue_requests(requests, max_in_flight)
+        self.eventLoop(self.session, resume)
+
+        requests = dict(requests)
+        for _ in range(retries):
+            if (not self.failed) or (not self.session_alive):
+                break
+
+            self.requeue_failed(requests, max_in_flight)
+            self.eventLoop(self.session)
+
+        return None
+
+    def requeue_failed(self, requests, max_in_flight=1):
+        # requests is a dictionary key -> request, the failed ones are queued again (alone)
+        failed, self.failed = sorted(self.failed), set()
+        self.throttled = set()
+        stats.logger.warning("Retrying %s failed request(s)", len(failed))
+
+        for key in failed:
+            self.clear_request(key)
+
+        self.queue_requests([(key, requests[key]) for key in failed], max_in_flight)
+        return None
+
+    def clear_request(self, key):
+        # Drop what has been decoded for a request before it is sent again
+        if isinstance(self.dictData.get(key), ColumnarBuilder):
+            self.dictData[key].clear()
+        return None
+
+    def queue_requests(self, requests, max_in_flight=1):
+        self.queue.extend(requests)
+        self.max_in_flight = max(1, max_in_flight)
+        self.priority = request_scheduler.current_priority.get()
+        self.deadline = current_deadline.get()
+        if self.deadline is not None:
+            self.deadline.register(self)
+        self.fill_in_flight()
+        return None
+
+    def fill_in_flight(self):
+        while self.queue and len(self.pending) < self.max_in_flight:
+            key, request = self.queue[0]
+
+            # The scheduler is only waited for when no request is in flight, the slots held by the requests in flight
+            # are released as their responses are processed
+            slot_scheduler = scheduler  # Module-level, None by default
+            if slot_scheduler is not None:
+                wait_start = time.perf_counter()
+                acquired = slot_scheduler.acquire(self.costs.get(key, 1), self.priority,
+                                                  blocking=self.wait_for_slots and not self.pending)
+                self.stats.add('scheduling', time.perf_counter() - wait_start)
+                if not acquired:
+                    break
+
+            self.queue.popleft()
+            correlation_id = self.send_request(request, key)
+            if slot_scheduler is not None:
+                self.scheduled[correlation_id.value()] = slot_scheduler
+        return None
+
+    def release_slots(self):
+        # Slots still held by abandoned requests (terminated session, interrupted call...)
+        for slot_scheduler in self.scheduled.values():
+            slot_scheduler.release()
+        self.scheduled = {}
+        return None
+
+    def is_limit(self, error_info):
+        # LIMIT errors (daily/monthly capacity reached, too many requests...) are the server pushing back
+        return error_info.hasElement(self.CATEGORY) and (error_info.getElementAsString(self.CATEGORY) == 'LIMIT')
+
+    def get_key(self, msg):
+        # Key of the request that msg belongs to (None if it does not belong to a pending request)
+        for correlation_id in msg.correlationIds():
+            if correlation_id.value() in self.pending:
+                return self.pending[correlation_id.value()]
+        return None
+
+    def complete_requests(self, event):
+        for msg in event:
+            for correlation_id in msg.correlationIds():
+                key = self.pending.pop(correlation_id.value(), None)
+                self.expires.pop(correlation_id.value(), None)
+                slot_scheduler = self.scheduled.pop(correlation_id.value(), None)
+                if slot_scheduler is not None:
+                    slot_scheduler.release(key in self.throttled)
+
+        self.fill_in_flight()
+        return None
+
+    def eventLoop(self, session, resume=0):
+        for event in self.iter_events(session, resume):
+            pass
+        return None
+
+    def iter_events(self, session, resume=0):
+        '''
+        Generator version of eventLoop, yields each PARTIAL_RESPONSE/RESPONSE event once it has been processed
+        If the session terminates, the unfinished intraday requests are resumed on a new session up to resume times
+        '''
+        for event in self.iter_session_events(session):
+            yield event
+
+        for _ in range(resume):
+            if self.session_alive or not (self.pending or self.queue) or not self.request_factories:
+                break
+
+            self.resume_requests()
+            for event in self.iter_session_events(self.session):
+                yield event
+
+        return None
+
+    def resume_requests(self):
+        '''
+        Reconnect and send the unfinished intraday requests again from the last timestamp received, the rows received
+        at that timestamp are dropped since the next request returns them again (they may have been cut short)
+        '''
+        if not self.reconnect():
+            return None
+
+        unfinished = sorted(set(self.pending.values()) | set(key for key, request in self.queue))
+        self.pending.clear()
+        self.expires.clear()
+        self.queue.clear()
+
+        self.check_service("//blp/refdata")
+
+        requests = []
+        for key in unfinished:
+            window_start, window_end = self.windows[key[1]]
+            builder = self.dictData[key]
+            if len(builder):
+                last_time = builder.column('time')[-1]
+                builder.drop_from('time', last_time)
+                window_start = pd.Timestamp(last_time).to_pydatetime()
+            requests.append((key, self.request_factories[key](window_start, window_end)))
+
+        stats.logger.warning("Resuming %s request(s)", len(requests))
+        self.queue_requests(requests, self.max_in_flight)
+        return None
+
+    def iter_session_events(self, session):
+        # Events of session until no request is pending or the session terminates
+        done = not self.pending
         while not done:
-            event = session.nextEvent(20)
+            event = self.next_event(session)
+            self.check_deadlines()
+            if event is None:
+                done = not self.pending  # The requests in flight may have timed out
+                continue
+
+            if self.recorder is not None:
+                self.recorder.record_event(event)
+
+            if event.eventType() in (blpapi.Event.PARTIAL_RESPONSE, blpapi.Event.RESPONSE, blpapi.Event.REQUEST_STATUS):
+                self.count_event()
+
             if event.eventType() == blpapi.Event.PARTIAL_RESPONSE:
                 self.processResponseEvent(event)
+                yield event
             elif event.eventType() == blpapi.Event.RESPONSE:
                 self.processResponseEvent(event)
-                done = True
+                self.complete_requests(event)
+                done = not self.pending
+                yield event
+            elif event.eventType() == blpapi.Event.REQUEST_STATUS:
+                self.processRequestStatusEvent(event)
+                done = not self.pending
             else:
                 for msg in event:
                     if event.eventType() == blpapi.Event.SESSION_STATUS:
                         if msg.messageType() == self.SESSION_TERMINATED:
+                            self.session_alive = False
                             done = True
         return None
 
+    def next_event(self, session):
+        '''
+        Next event of session, None if the nearest deadline passes first or if wake() is called
+        With wait='blocking' the caller sleeps in nextEvent (max_wait at most), with wait='callback' on the queue of
+        the events pushed by the event handler of the session
+        '''
+        wait = self.time_left()
+        if self.wait == 'callback':
+            try:
+                return self.events.get(timeout=wait)
+            except queue.Empty:
+                return None
+
+        wait = self.max_wait if wait is None else min(wait, self.max_wait)
+        event = session.nextEvent(max(1, math.ceil(wait * 1000)))
+        return event if event.eventType() != blpapi.Event.TIMEOUT else None
+
+    def time_left(self):
+        # Seconds until the nearest deadline (of the call or of a request in flight), None if there is none
+        times = list(self.expires.values())
+        if (self.deadline is not None) and (self.deadline.expires is not None):
+            times.append(self.deadline.expires)
+        return max(0.0, min(times) - time.monotonic()) if times else None
+
+    def wake(self):
+        # Wake up the caller waiting in next_event (thread-safe), with wait='blocking' it wakes up within max_wait
+        if self.events is not None:
+            self.events.put(None)
+        return None
+
+    def cancel(self):
+        '''
+        Cancel the requests (queued and in flight) of the current call, the call raises CancelledError
+        This is a thread-safe method
+        '''
+        self.cancel_requested = True
+        self.wake()
+        return None
+
+    def check_deadlines(self):
+        '''
+        Fail the requests in flight past their request timeout (they are sent again if the call has retries), raise
+        TimeoutError once the deadline of the call has passed and CancelledError if the call has been cancelled
+        '''
+        if self.cancel_requested or ((self.deadline is not None) and self.deadline.cancelled):
+            self.cancel_requests()
+            raise concurrent.futures.CancelledError('The requests have been cancelled')
+
+        now = time.monotonic()
+        if (self.deadline is not None) and (self.deadline.expires is not None) and (now >= self.deadline.expires):
+            self.cancel_requests()
+            raise TimeoutError('The requests did not complete within {} seconds'.format(self.deadline.timeout))
+
+        expired = [value for value, expires in self.expires.items() if now >= expires]
+        for value in expired:
+            stats.logger.warning("REQUEST TIMED OUT after %s seconds", self.deadline.request_timeout)
+            self.failed.add(self.cancel_request(value))
+        if expired:
+            self.fill_in_flight()
+        return None
+
+    def cancel_request(self, value):
+        # Cancel the request in flight of correlation id value, returns its key
+        self.session.cancel(blpapi.CorrelationId(value))
+        self.expires.pop(value, None)
+        slot_scheduler = self.scheduled.pop(value, None)
+        if slot_scheduler is not None:
+            slot_scheduler.release()
+        return self.pending.pop(value)
+
+    def cancel_requests(self):
+        for value in list(self.pending):
+            self.cancel_request(value)
+        self.queue.clear()
+        return None
+
+    def count_event(self):
+        # The server latency is measured up to the first event answering the request
+        if self.stats.events == 0 and self.stats.sent_at is not None:
+            self.stats.add('server_latency', time.perf_counter() - self.stats.sent_at)
+        self.stats.events += 1
+        return None
+
+    def request_type(self):
+        for request_type, flag in (('IntradayBar', self.boo_getIntradayBar), ('IntradayTick', self.boo_getIntradayTick),
+                                   ('RefData', self.boo_getRefData), ('HistoData', self.boo_getHistoData),
+                                   ('BulkData', self.boo_getBulkData)):
+            if flag:
+                return request_type
+        return None
+
+    def finish(self, df_buffer, assembly_start):
+        '''
+        Attach the stats of the request to the dataframe (df.attrs['stats']) and hand them to the stats callbacks
+        bytes is the memory used by the dataframe, object columns are counted as pointers
+        '''
+        df_buffer = self.compact_frame(df_buffer)
+        self.stats.add('assembly', time.perf_counter() - assembly_start)
+        self.stats.rows = len(df_buffer)
+        self.stats.elements = df_buffer.size
+        self.stats.bytes = int(df_buffer.memory_usage(deep=False).sum())
+        df_buffer.attrs['stats'] = self.stats
+        df_buffer.attrs['failed'] = self.failed_tickers()
+        self.publish_stats()
+        return df_buffer
+
+    def failed_tickers(self):
+        '''
+        Tickers of the requests that failed or had not completed when the call ended (terminated session, resume exhausted...),
+        their data is missing or partial so that the caches must not store it as complete (df.attrs['failed'])
+        '''
+        incomplete = self.failed | set(self.pending.values()) | set(key for key, request in self.queue)
+        return sorted(set(ticker for key in incomplete for ticker in self.key_tickers.get(key, [])))
+
+    def compact_frame(self, df_buffer):
+        if self.compact:
+            return compact_frame(df_buffer, self.compact == 'float32')
+        return df_buffer
+
+    def price_dtype(self):
+        return np.float32 if self.compact == 'float32' else np.float64
+
+    def publish_stats(self):
+        self.stats.request_type = self.request_type()
+        self.stats.add('session_start', self.unreported_start)
+        self.stats.add('total', time.perf_counter() - self.stats.started_at + self.unreported_start)
+        self.unreported_start = 0.0
+        stats.publish(self.stats)
+        return None
+
+    def flush_builders(self, tickers, columns, categories=None, hold_back=True):
+        '''
+        Frames of the rows decoded since the previous flush, the builders are replaced since the frames hold views of their arrays
+        The rows at the last timestamp of the requests in flight are held back until the next flush (hold_back=True)
+        so that they can be received again if the request is resumed
+        '''
+        in_flight = set(self.pending.values()) | set(key for key, request in self.queue)
+
+        list_df_buffer = []
+        for key, builder in sorted(self.dictData.items()):
+            tail = None
+            if hold_back and (key in in_flight) and len(builder):
+                if builder.column('time')[0] == builder.column('time')[-1]:
+                    continue  # Nothing but held back rows
+                tail = builder.split_from('time', builder.column('time')[-1])
+            if len(builder):
+                list_df_buffer.append(self.compact_frame(self.window_frame(key, tickers)))
+                self.dictData[key] = tail if tail is not None else ColumnarBuilder(columns, categories)
+        return list_df_buffer
+
+    def stream_frames(self, tickers, columns, categories=None, hold_back=True):
+        # Frames flushed after an event, the stats are counted chunk by chunk
+        assembly_start = time.perf_counter()
+        list_df_buffer = self.flush_builders(tickers, columns, categories, hold_back)
+        self.stats.add('assembly', time.perf_counter() - assembly_start)
+        for df_buffer in list_df_buffer:
+            self.stats.rows += len(df_buffer)
+            self.stats.elements += df_buffer.size
+            self.stats.bytes += int(df_buffer.memory_usage(deep=False).sum())
+            yield df_buffer
+
+    def window_frame(self, key, tickers):
+        '''
+        Frame of the intraday request key = (ticker index, window index)
+        The rows at or after the end of a window are dropped as they are also returned by the next window
+        '''
+        ticker_index, window_index = key
+        builder = self.dictData[key]
+
+        if window_index < len(self.windows) - 1:
+            builder.drop_from('time', np.datetime64(self.windows[window_index][1]))
+
+        return builder.to_frame(tickers[ticker_index])
+
+    def intraday_frame(self, tickers):
+        # Windows are stitched back in time order for each ticker
+        return pd.concat(union_categories([self.window_frame(key, tickers) for key in sorted(self.dictData)]))
+
+    def processRequestStatusEvent(self, event):
+        for msg in event:
+            if msg.messageType() == self.REQUEST_FAILURE:
+                stats.logger.warning("REQUEST FAILED: %s", msg.getElement(self.REASON))
+                if self.get_key(msg) is not None:
+                    self.failed.add(self.get_key(msg))
+                    if self.is_limit(msg.getElement(self.REASON)):
+                        self.throttled.add(self.get_key(msg))
+        self.complete_requests(event)
+        return None
+
     def processResponseEvent(self, event):
+        decode_start = time.perf_counter()
         for msg in event:
+            self.stats.messages += 1
+            key = self.get_key(msg)
+            if key is None:
+                continue  # Late message of a request that is no longer pending
+
             if msg.hasElement(self.RESPONSE_ERROR):
                 self.printErrorInfo("REQUEST FAILED: ", msg.getElement(self.RESPONSE_ERROR))
+                self.failed.add(key)
+                if self.is_limit(msg.getElement(self.RESPONSE_ERROR)):
+                    self.throttled.add(key)
                 continue
 
             if self.boo_getIntradayBar:
-                self.process_msg_intradaybar(msg)
+                self.process_msg_intradaybar(msg, self.dictData[key])
             elif self.boo_getIntradayTick:
-                self.process_msg_intradaytick(msg)
+                self.process_msg_intradaytick(msg, self.dictData[key])
             elif self.boo_getRefData:
-                self.process_msg_refdata(msg)
+                self.process_msg_refdata(msg, key)
             elif self.boo_getHistoData:
-                self.process_msg_histodata(msg)
+                self.process_msg_histodata(msg, self.dictData[key])
+            elif self.boo_getFieldInfo:
+                self.process_msg_fieldinfo(msg)
+            elif self.boo_getBulkData:
+                self.process_msg_bulkdata(msg, key, self.dictData[key])
 
+        self.stats.add('decode', time.perf_counter() - decode_start)
         return None
 
-    def get_intradaybar(self, security, event, start_date, end_date, barInterval, other_param):
+    def get_intradaybar(self, security, event, start_date, end_date, barInterval, other_param, max_in_flight=1,
+                        window=None, retries=0, compact=False, resume=3):
+        '''
+        security can be a ticker or a list of tickers, one request is sent per ticker (and per time window)
+        and up to max_in_flight of them are outstanding at the same time
+        If the session terminates, the unfinished requests continue from the last bar received on a new session (up to resume times)
+        '''
+        tickers = [security] if type(security) == str else security
+
+        requests = self.intradaybar_requests(tickers, event, start_date, end_date, barInterval, other_param, window, compact)
+        self.send_requests(requests, max_in_flight, retries, resume) # Wait for events from session
+
+        assembly_start = time.perf_counter()
+        return self.finish(self.intraday_frame(tickers), assembly_start)
+
+    def stream_intradaybar(self, security, event, start_date, end_date, barInterval, other_param, max_in_flight=1,
+                           window=None, compact=False, resume=3):
+        '''
+        Generator yielding a dataframe of the bars received in each PARTIAL_RESPONSE/RESPONSE event
+        '''
+        tickers = [security] if type(security) == str else security
+
+        requests = self.intradaybar_requests(tickers, event, start_date, end_date, barInterval, other_param, window, compact)
+        self.queue_requests(requests, max_in_flight)
+
+        # The stats are published once the last chunk has been yielded
+        for _ in self.iter_events(self.session, resume):
+            for df_buffer in self.stream_frames(tickers, self.intradaybar_columns()):
+                yield df_buffer
+
+        # Rows held back by the requests that could not be resumed
+        for df_buffer in self.stream_frames(tickers, self.intradaybar_columns(), hold_back=False):
+            yield df_buffer
+
+        self.publish_stats()
+
+    def intradaybar_requests(self, tickers, event, start_date, end_date, barInterval, other_param, window=None, compact=False):
+        self.reset()
         self.boo_getIntradayBar = True
+        self.compact = compact
+        self.windows = split_time_range(start_date, end_date, window)
 
-        try:
-            self.check_service("//blp/refdata")
+        self.check_service("//blp/refdata")
 
-            refDataService = self.session.getService("//blp/refdata")
-            request = refDataService.createRequest("IntradayBarRequest")
+        requests = []
+        for ticker_index, ticker in enumerate(tickers):
+            for window_index, (window_start, window_end) in enumerate(self.windows):
+                key = (ticker_index, window_index)
+                self.request_factories[key] = functools.partial(self.intradaybar_request, ticker, event, barInterval, other_param)
+                self.key_tickers[key] = [ticker]
+                self.dictData[key] = ColumnarBuilder(self.intradaybar_columns())
+                requests.append((key, self.request_factories[key](window_start, window_end)))
 
-            # Only one security/eventType per request
-            request.set("security", security)
-            request.set("eventType", event)
-            request.set("interval", barInterval)
+        return requests
 
-            # All times are in GMT
-            request.set("startDateTime", start_date)
-            request.set("endDateTime", end_date)
+    def intradaybar_request(self, ticker, event, barInterval, other_param, start, end):
+        request = self.session.getService("//blp/refdata").createRequest("IntradayBarRequest")
 
-            # Append other parameters if there are
-            request = self.set_other_param(other_param, request)
+        # Only one security/eventType per request
+        request.set("security", ticker)
+        request.set("eventType", event)
+        request.set("interval", barInterval)
 
-            self.session.sendRequest(request)
-            self.eventLoop(self.session) # Wait for events from session
+        # All times are in GMT
+        request.set("startDateTime", start)
+        request.set("endDateTime", end)
 
-        finally:
-            # Stop the session
-            self.session.stop()
-            df_buffer = pd.DataFrame.from_dict(self.dictData,
-                                               orient='index',
-                                               columns=['open', 'high', 'low', 'close', 'volume', 'numEvents', 'value'])
-            df_buffer['ticker'] = security
-            df_buffer = df_buffer.reset_index(level=0).rename(columns={'index': 'time'}).set_index(['time', 'ticker'])
+        # Append other parameters if there are
+        request = self.set_other_param(other_param, request)
 
-            return df_buffer.fillna(value=np.nan)
+        return request
+
+    def intradaybar_columns(self):
+        price_dtype = self.price_dtype()
+        return [('time', 'datetime64[ns]'),
+                ('open', price_dtype), ('high', price_dtype), ('low', price_dtype), ('close', price_dtype),
+                ('volume', np.int64), ('numEvents', np.int64), ('value', np.int64)]
 
 
-    def process_msg_intradaybar(self, msg):
+    def process_msg_intradaybar(self, msg, builder):
         data = msg.getElement(self.BAR_DATA).getElement(self.BAR_TICK_DATA)
 
         for bar in data.values():
@@ -173,180 +1166,444 @@ class BLP():
             volume = bar.getElementAsInteger(self.VOLUME)
             value = bar.getElementAsInteger(self.VALUE)
 
-            self.dictData[time] = [open, high, low, close, volume, numEvents, value]  # Increment rows in a dictionary
+            builder.append([time, open, high, low, close, volume, numEvents, value])  # Append a row to the columns
 
         return None
 
-    def get_refdata(self, security, fields, overrides, other_param):
+    def get_refdata(self, security, fields, overrides, other_param, batch_size=None, max_fields=None, max_in_flight=1,
+                    retries=0, compact=False, field_info=None):
+        '''
+        The request is split into batches of at most batch_size securities and max_fields fields (one batch by default),
+        up to max_in_flight batches are outstanding at the same time and the failed ones are sent again up to retries times
+        field_info (FieldCache) decodes the fields with the typed getters chosen from their //blp/apiflds metadata
+        '''
+        dict_info, lookup_stats = self.lookup_fields(fields, field_info)
+        requests = self.refdata_requests(security, fields, overrides, other_param, batch_size, max_fields, compact, dict_info)
+        self.send_requests(requests, max_in_flight, retries)  # Wait for events from session.
+        self.add_lookup_stats(lookup_stats)
+
+        assembly_start = time.perf_counter()
+        return self.finish(self.refdata_frame(fields), assembly_start)
+
+    def refdata_requests(self, security, fields, overrides, other_param, batch_size=None, max_fields=None, compact=False,
+                         field_info=None):
+        '''
+        field_info is a dictionary field -> //blp/apiflds metadata, when it is given the fields are decoded into typed
+        columns preallocated for every security instead of a dictionary per security
+        '''
+        self.reset()
         self.boo_getRefData = True
+        self.compact = compact
         self.fields = fields
+        self.batch_fields = {}  # Key of a batch -> its fields
+        self.decoders = {field: field_decoder(field, field_info.get(field) if field_info != None else None) for field in fields}
 
-        try:
-            self.check_service("//blp/refdata")
+        self.columns = None
+        if field_info != None:
+            self.positions = {}  # Security -> row of the typed columns, in the order of the request
+            for ticker in security:
+                self.positions.setdefault(ticker, len(self.positions))
+            self.columns = {field: np.full(len(self.positions), missing, dtype=object if dtype == 'auto' else dtype)
+                            for field, (name, getter, dtype, missing) in self.decoders.items()}
 
-            refDataService = self.session.getService("//blp/refdata")
-            request = refDataService.createRequest("ReferenceDataRequest")
+        self.check_service("//blp/refdata")
 
-            # Append securities to request
-            for ticker in security:
-                request.append("securities", ticker)
+        refDataService = self.session.getService("//blp/refdata")
 
-            # Append fields to request
-            for field in fields:
-                request.append("fields", field)
+        security_batches = split_list(security, batch_size)
+        field_batches = split_list(fields, max_fields)
 
-            # Append other parameters if there are
-            request = self.set_other_param(other_param, request)
+        requests = []
+        for i, list_securities in enumerate(security_batches):
+            for j, list_fields in enumerate(field_batches):
+                request = refDataService.createRequest("ReferenceDataRequest")
 
-            # Add overrides if there are
-            request = self.set_overrides(overrides, request)
+                # Append securities to request
+                for ticker in list_securities:
+                    request.append("securities", ticker)
 
-            self.session.sendRequest(request)
-            self.eventLoop(self.session)        # Wait for events from session.
+                # Append fields to request
+                for field in list_fields:
+                    request.append("fields", field)
 
-        finally:
-            self.session.stop()
+                # Append other parameters if there are
+                request = self.set_other_param(other_param, request)
 
-        df_buffer = pd.DataFrame.from_dict(self.dictData, orient='index', columns=fields).fillna(value=np.nan)
+                # Add overrides if there are
+                request = self.set_overrides(overrides, request)
 
-        return df_buffer
+                self.batch_fields[(i, j)] = list_fields
+                self.key_tickers[(i, j)] = list_securities
+                self.costs[(i, j)] = len(list_securities) * len(list_fields)
+                requests.append(((i, j), request))
+
+        return requests
+
+    def refdata_frame(self, fields):
+        if self.columns is not None:
+            return pd.DataFrame(self.columns, index=list(self.positions), columns=fields, copy=False)
+
+        # The batches are merged into one row per security, the missing cells are np.nan so compact mode skips the fillna copy
+        df_buffer = pd.DataFrame.from_dict({ticker: [row.get(field, np.nan) for field in fields] for ticker, row in self.dictData.items()},
+                                           orient='index',
+                                           columns=fields)
 
+        return df_buffer if self.compact else df_buffer.fillna(value=np.nan)
 
-    def process_msg_refdata(self, msg):
+
+    def process_msg_refdata(self, msg, key):
         data = msg.getElement(self.SECURITY_DATA)
 
         for securityData in data.values():
             field_data = securityData.getElement(self.FIELD_DATA)  # Element that contains all the fields
             security_ticker = securityData.getElementAsString(self.SECURITY)  # Get Ticker
-            self.dictData[security_ticker] = []  # Create list of fields
 
-            for my_field in self.fields:
-                if field_data.hasElement(my_field):  # Check if the field exists for this particular ticker
-                    self.dictData[security_ticker].append(field_data.getElement(my_field).getValue())
+            if self.columns is not None:
+                # Typed columns, the missing cells are already filled
+                position = self.security_position(security_ticker)
+                for my_field in self.batch_fields[key]:
+                    name, getter, dtype, missing = self.decoders[my_field]
+                    if field_data.hasElement(name):
+                        self.columns[my_field][position] = getter(field_data)
+                continue
+
+            row = self.dictData.setdefault(security_ticker, {})  # Fields of the security, filled by each batch
+
+            for my_field in self.batch_fields[key]:
+                name, getter, dtype, missing = self.decoders[my_field]
+                if field_data.hasElement(name):  # Check if the field exists for this particular ticker
+                    row[my_field] = getter(field_data)
                 else:
-                    self.dictData[security_ticker].append(None)
+                    row[my_field] = missing
+
+        return None
+
+    def security_position(self, ticker):
+        # Row of ticker in the typed columns, a security that was not requested as such is appended
+        if ticker not in self.positions:
+            self.positions[ticker] = len(self.positions)
+            for field, column in self.columns.items():
+                self.columns[field] = np.append(column, np.full(1, self.decoders[field][3], dtype=column.dtype))
+        return self.positions[ticker]
+
+    def get_bulkdata(self, security, fields, overrides, other_param, batch_size=None, max_fields=None, max_in_flight=1,
+                     retries=0):
+        '''
+        Bulk fields (INDX_MEMBERS, DVD_HIST_ALL, OPT_CHAIN...) in a long format, batched like get_refdata
+        '''
+        requests = self.bulkdata_requests(security, fields, overrides, other_param, batch_size, max_fields)
+        self.send_requests(requests, max_in_flight, retries)
+
+        assembly_start = time.perf_counter()
+        return self.finish(self.bulkdata_frame(), assembly_start)
+
+    def bulkdata_requests(self, security, fields, overrides, other_param, batch_size=None, max_fields=None):
+        requests = self.refdata_requests(security, fields, overrides, other_param, batch_size, max_fields)
+        self.boo_getRefData = False
+        self.boo_getBulkData = True
+
+        # One builder per batch: ticker, field and row of the bulk value, then one column per sub-element found
+        for key, request in requests:
+            self.dictData[key] = ColumnarBuilder([('ticker', 'category'), ('field', 'category'), ('row', np.int64)],
+                                                 {'ticker': security, 'field': fields})
 
+        return requests
+
+    def bulkdata_frame(self):
+        '''
+        Returns a pandas dataframe with a Multi-index (ticker/field/row) and one column per sub-element of the bulk values
+        (NaN for the fields that do not have it)
+        '''
+        list_df_buffer = []
+        for key, builder in sorted(self.dictData.items()):
+            df_index = pd.MultiIndex.from_arrays([builder.column('ticker'), builder.column('field'), builder.column('row')],
+                                                 names=['ticker', 'field', 'row'])
+            columns = builder.names[3:]
+            list_df_buffer.append(pd.DataFrame({name: builder.column(name) for name in columns}, index=df_index,
+                                               columns=columns, copy=False))
+
+        return pd.concat(list_df_buffer)
+
+    def process_msg_bulkdata(self, msg, key, builder):
+        data = msg.getElement(self.SECURITY_DATA)
+
+        for securityData in data.values():
+            field_data = securityData.getElement(self.FIELD_DATA)
+            security_ticker = securityData.getElementAsString(self.SECURITY)
+
+            for my_field in self.batch_fields[key]:
+                name = self.decoders[my_field][0]
+                if not field_data.hasElement(name):
+                    continue
+
+                bulk = field_data.getElement(name)
+                if not bulk.isArray():
+                    self.append_bulk_row(builder, [security_ticker, my_field, 0], {'value': bulk.getValue()})
+                    continue
+
+                # Each value of the array is a sequence, one row per value and one column per sub-element
+                for position, bulk_row in enumerate(bulk.values()):
+                    values = {}
+                    for sub_element in bulk_row.elements():
+                        if not sub_element.isNull():
+                            values[str(sub_element.name())] = sub_element.getValue()
+                    self.append_bulk_row(builder, [security_ticker, my_field, position], values)
+
+        return None
+
+    def append_bulk_row(self, builder, row, values):
+        # The sub-elements seen for the first time become new columns of the builder
+        for name in values:
+            if name not in builder.names:
+                builder.add_column(name)
+
+        builder.append(row + [values.get(name, np.nan) for name in builder.names[3:]])
         return None
 
+    def get_fieldinfo(self, fields):
+        '''
+        //blp/apiflds metadata of fields: dictionary upper case mnemonic -> {'datatype': ..., 'ftype': ...}, None for the
+        fields unknown to Bloomberg. Nothing is returned if the request failed so that the fields are not cached
+        '''
+        self.reset()
+        self.boo_getFieldInfo = True
+
+        self.check_service("//blp/apiflds")
+
+        request = self.session.getService("//blp/apiflds").createRequest("FieldInfoRequest")
+        for field in fields:
+            request.append("id", field)
+        request.set("returnFieldDocumentation", False)
+
+        self.send_requests([(0, request)])
+
+        if self.failed or (not self.session_alive):
+            return {}
+        return dict(self.dictData)
+
+    def lookup_fields(self, fields, field_info):
+        '''
+        Metadata of the fields from field_info (FieldCache) and the stats of the //blp/apiflds lookup if one was sent (None otherwise)
+        The lookup resets the object, its stats are added to the ones of the call once its requests are done, see add_lookup_stats
+        '''
+        if field_info is None:
+            return None, None
+
+        list_stats = []
+        def fetch(missing_fields):
+            dict_info = self.get_fieldinfo(missing_fields)
+            list_stats.append(self.stats)
+            return dict_info
+
+        dict_info = field_info.get_fields(fields, fetch)
+        return dict_info, (list_stats[0] if list_stats else None)
+
+    def add_lookup_stats(self, lookup_stats):
+        if lookup_stats is not None:
+            merged = RequestStats.merge([lookup_stats, self.stats])
+            merged.started_at = lookup_stats.started_at  # The total of the call includes the lookup
+            self.stats = merged
+        return None
+
+    def process_msg_fieldinfo(self, msg):
+        for field_data in msg.getElement(self.FIELD_DATA).values():
+            if field_data.hasElement(self.FIELD_INFO):
+                field_info = field_data.getElement(self.FIELD_INFO)
+                self.dictData[field_info.getElementAsString(self.MNEMONIC).upper()] = {
+                    'datatype': field_info.getElementAsString(self.DATATYPE),
+                    'ftype': field_info.getElementAsString(self.FTYPE)}
+            elif field_data.hasElement(self.FIELD_ERROR):
+                self.dictData[field_data.getElementAsString(self.ID).upper()] = None
+
+        return None
+
+
+    def get_histodata(self,security, fields, start_date, end_date, overrides, other_param, layout='long', compact=False,
+                      field_info=None):
+
+        # field_info (FieldCache) decodes the fields with the typed getters chosen from their //blp/apiflds metadata
+        dict_info, lookup_stats = self.lookup_fields(fields, field_info)
+        requests = self.histodata_requests(security, fields, start_date, end_date, overrides, other_param, compact, dict_info)
+        self.send_requests(requests)  # Send the request and wait for events from session.
+        self.add_lookup_stats(lookup_stats)
+
+        assembly_start = time.perf_counter()
+        return self.finish(self.histodata_frame(layout), assembly_start)
 
-    def get_histodata(self,security, fields, start_date, end_date, overrides, other_param):
+    def histodata_requests(self, security, fields, start_date, end_date, overrides, other_param, compact=False, field_info=None):
 
+        self.reset()
         self.boo_getHistoData = True
+        self.compact = compact
         self.fields = fields
+        self.decoders = [field_decoder(field, field_info.get(field) if field_info != None else None) for field in fields]
 
-        try:
-            self.check_service("//blp/refdata")
+        self.check_service("//blp/refdata")
 
-            # Obtain previously opened service
-            refDataService = self.session.getService("//blp/refdata")
+        # Obtain previously opened service
+        refDataService = self.session.getService("//blp/refdata")
 
-            # Create and fill the request for the historical data
-            request = refDataService.createRequest("HistoricalDataRequest")
+        # Create and fill the request for the historical data
+        request = refDataService.createRequest("HistoricalDataRequest")
 
-            # Append securities to request
-            for ticker in security:
-                request.getElement("securities").appendValue(ticker)
+        # Append securities to request
+        for ticker in security:
+            request.getElement("securities").appendValue(ticker)
 
-            # Append fields to request
-            for field in fields:
-                request.getElement("fields").appendValue(field)
+        # Append fields to request
+        for field in fields:
+            request.getElement("fields").appendValue(field)
 
-            request.set("startDate", start_date.strftime('%Y%m%d'))
-            request.set("endDate", end_date.strftime('%Y%m%d'))
+        request.set("startDate", start_date.strftime('%Y%m%d'))
+        request.set("endDate", end_date.strftime('%Y%m%d'))
 
-            # Append other parameters if there are
-            request = self.set_other_param(other_param, request)
+        # Append other parameters if there are
+        request = self.set_other_param(other_param, request)
 
-            # Add overrides if there are
-            request = self.set_overrides(overrides, request)
+        # Add overrides if there are
+        request = self.set_overrides(overrides, request)
 
-            self.session.sendRequest(request) # Send the request
-            self.eventLoop(self.session)      # Wait for events from session.
+        # One data point per security, field and business day
+        self.costs[0] = len(security) * len(fields) * max(1, int(np.busday_count(start_date.date(), end_date.date())) + 1)
 
-        finally:
-            # Stop the session
-            self.session.stop()
+        # The field columns are typed from the //blp/apiflds metadata when it is known
+        columns = [(field, dtype) for field, (name, getter, dtype, missing) in zip(fields, self.decoders)]
+        self.dictData[0] = ColumnarBuilder([('date', 'datetime64[ns]'), ('ticker', 'category')] + columns, {'ticker': security})
+        self.key_tickers[0] = security
+
+        return [(0, request)]
 
-        # Returns a pandas dataframe with a Multi-index (date/ticker)
-        df_buffer = pd.concat(self.list_df_buffer).reset_index(level=0).rename(columns={'index': 'date'}).set_index(['date', 'ticker'])
+    def histodata_frame(self, layout='long'):
+        # Returns a pandas dataframe with a Multi-index (date/ticker), or dates x (field, ticker) in the wide layout
+        if layout == 'wide':
+            return self.dictData[0].to_wide_frame(index='date')
 
-        return df_buffer.fillna(value=np.nan)
+        return self.dictData[0].to_frame(index='date')
 
 
-    def process_msg_histodata(self, msg):
-        dictData = {}  # Used for structuring the data received from bloomberg
+    def process_msg_histodata(self, msg, builder):
         security_data = msg.getElement(self.SECURITY_DATA)
         data = security_data.getElement(self.FIELD_DATA)  # Iterable object that contains all the fields
         security_ticker = security_data.getElementAsString(self.SECURITY)  # Get Ticker (there is only one ticker by message)
 
         for field_data in data.values():  # Iterate through each date
-            date = field_data.getElement('date').getValue()
-            dictData[date] = []
-            dictData[date].append(security_ticker)
+            row = [field_data.getElement(self.DATE).getValue(), security_ticker]
 
-            for my_field in self.fields:
-                if field_data.hasElement(my_field):  # Check if the field exists for this particular ticker
-                    dictData[date].append(field_data.getElement(my_field).getValue())  # Increment dictionary
+            for name, getter, dtype, missing in self.decoders:
+                if field_data.hasElement(name):  # Check if the field exists for this particular ticker
+                    row.append(getter(field_data))
                 else:
-                    dictData[date].append(None)
+                    row.append(missing)
 
-        # Append data to the list of dataframe (concatenated in the end)
-        self.list_df_buffer.append(pd.DataFrame.from_dict(dictData, orient='index', columns=['ticker'] + self.fields))
+            builder.append(row)  # One columnar accumulator for the whole request
 
         return None
 
 
-    def get_intradaytick(self, ticker, list_events, start_date, end_date, condition_codes, other_param):
+    def get_intradaytick(self, ticker, list_events, start_date, end_date, condition_codes, other_param, max_in_flight=1,
+                         window=None, retries=0, compact=False, resume=3):
+        '''
+        ticker can be a ticker or a list of tickers, one request is sent per ticker (and per time window)
+        and up to max_in_flight of them are outstanding at the same time
+        If the session terminates, the unfinished requests continue from the last tick received on a new session (up to resume times)
+        '''
+        tickers = [ticker] if type(ticker) == str else ticker
+
+        requests = self.intradaytick_requests(tickers, list_events, start_date, end_date, condition_codes, other_param, window,
+                                              compact)
+        self.send_requests(requests, max_in_flight, retries, resume)
+
+        assembly_start = time.perf_counter()
+        return self.finish(self.intraday_frame(tickers), assembly_start)
+
+    def stream_intradaytick(self, ticker, list_events, start_date, end_date, condition_codes, other_param, max_in_flight=1,
+                            window=None, compact=False, resume=3):
+        '''
+        Generator yielding a dataframe of the ticks received in each PARTIAL_RESPONSE/RESPONSE event
+        '''
+        tickers = [ticker] if type(ticker) == str else ticker
+
+        requests = self.intradaytick_requests(tickers, list_events, start_date, end_date, condition_codes, other_param, window,
+                                              compact)
+        self.queue_requests(requests, max_in_flight)
+
+        # The stats are published once the last chunk has been yielded
+        for _ in self.iter_events(self.session, resume):
+            for df_buffer in self.stream_frames(tickers, self.intradaytick_columns(), {'type': list_events}):
+                yield df_buffer
+
+        # Rows held back by the requests that could not be resumed
+        for df_buffer in self.stream_frames(tickers, self.intradaytick_columns(), {'type': list_events}, hold_back=False):
+            yield df_buffer
+
+        self.publish_stats()
+
+    def intradaytick_requests(self, tickers, list_events, start_date, end_date, condition_codes, other_param, window=None,
+                              compact=False):
+        self.reset()
         self.boo_getIntradayTick = True
+        self.compact = compact
+        self.windows = split_time_range(start_date, end_date, window)
 
-        try:
-            self.check_service("//blp/refdata")
+        self.check_service("//blp/refdata")
 
-            refDataService = self.session.getService("//blp/refdata")
-            request = refDataService.createRequest("IntradayTickRequest")
+        # Create set of column names if extra columns added to other_param
+        self.extra_columns = ['conditionCodes'] if condition_codes else []
 
-            # only one security/eventType per request
-            request.set("security", ticker)
+        if other_param != None:
+            for k,v in other_param.items():
+                if ('include' in k):
+                    if v:
+                        col_name = k.replace('include', '')
+                        col_name = col_name[:1].lower() + col_name[1:]
+                        self.extra_columns.append(col_name)
 
-            # Add fields to request
-            for event in list_events:
-                request.getElement("eventTypes").appendValue(event)
+        requests = []
+        for ticker_index, security in enumerate(tickers):
+            for window_index, (window_start, window_end) in enumerate(self.windows):
+                key = (ticker_index, window_index)
+                self.request_factories[key] = functools.partial(self.intradaytick_request, security, list_events, condition_codes,
+                                                                other_param)
+                self.key_tickers[key] = [security]
+                self.dictData[key] = ColumnarBuilder(self.intradaytick_columns(), {'type': list_events})
+                requests.append((key, self.request_factories[key](window_start, window_end)))
 
-            # All times are in GMT
-            request.set("startDateTime", start_date)
-            request.set("endDateTime", end_date)
+        return requests
 
-            # Add condition codes
-            request.set("includeConditionCodes", condition_codes)
+    def intradaytick_request(self, security, list_events, condition_codes, other_param, start, end):
+        request = self.session.getService("//blp/refdata").createRequest("IntradayTickRequest")
 
-            # Append other parameters if there are
-            request = self.set_other_param(other_param, request)
+        # only one security/eventType per request
+        request.set("security", security)
 
-            # Create set of column names if extra columns added to other_param
-            self.extra_columns = ['conditionCodes'] if condition_codes else []
+        # Add fields to request
+        for event in list_events:
+            request.getElement("eventTypes").appendValue(event)
 
-            if other_param != None:
-                for k,v in other_param.items():
-                    if ('include' in k):
-                        if v:
-                            col_name = k.replace('include', '')
-                            col_name = col_name[:1].lower() + col_name[1:]
-                            self.extra_columns.append(col_name)
+        # All times are in GMT
+        request.set("startDateTime", start)
+        request.set("endDateTime", end)
 
-            self.session.sendRequest(request)
-            self.eventLoop(self.session)
+        # Add condition codes
+        request.set("includeConditionCodes", condition_codes)
 
-        finally:
-            # Stop the session
-            self.session.stop()
+        # Append other parameters if there are
+        request = self.set_other_param(other_param, request)
 
-        df_buffer = pd.DataFrame.from_dict(self.dictData, orient='index', columns=['type', 'value', 'size'] + self.extra_columns)
-        df_buffer['ticker'] = ticker
-        df_buffer = df_buffer.reset_index(level=0).rename(columns={'index': 'time'}).set_index(['time', 'ticker'])
+        return request
+
+    def intradaytick_columns(self):
+        # Extra columns (condition codes, ...) are kept as python objects, NaN when missing
+        # In compact mode the codes columns (conditionCodes, exchangeCode, ...) are categorical
+        return [('time', 'datetime64[ns]'), ('type', 'category'), ('value', self.price_dtype()), ('size', np.int64)] + \
+               [(extra_col, self.extra_column_dtype(extra_col)) for extra_col in self.extra_columns]
 
-        return df_buffer.fillna(value=np.nan)
+    def extra_column_dtype(self, extra_col):
+        if self.compact and ('Code' in extra_col):
+            return 'category'
+        return object
 
-    def process_msg_intradaytick(self, msg):
+    def process_msg_intradaytick(self, msg, builder):
         data = msg.getElement(self.TICK_DATA).getElement(self.TICK_DATA)
 
         for item in data.values():
@@ -355,20 +1612,218 @@ class BLP():
             value = item.getElementAsFloat(self.VALUE)
             size = item.getElementAsInteger(self.TICK_SIZE)
 
-            self.dictData[time] = [str_type, value, size]  # Increment rows in a dictionary
+            row = [time, str_type, value, size]
 
-            extra_data = []
             for extra_col in self.extra_columns:
                 if item.hasElement(extra_col):
-                    extra_data.append(item.getElement(extra_col).getValue())
+                    row.append(item.getElement(extra_col).getValue())
                 else:
-                    extra_data.append(None)
+                    row.append(np.nan)
+
+            builder.append(row)  # Every tick is kept, even when several share the same timestamp
 
-            self.dictData[time] += extra_data
+        return None
 
+    def subscribe(self, security, fields, size=10000, options=None):
+        '''
+        Subscribe to the //blp/mktdata fields of security (a ticker or a list of tickers)
+        The updates of each ticker are written into a RingBuffer of its latest size updates (numeric fields only,
+        the fields missing from an update are np.nan) by a background thread, read them with snapshot()
+        options is passed to blpapi.SubscriptionList.add, e.g. 'interval=1.0' for conflated updates
+        '''
+        tickers = [security] if type(security) == str else security
+
+        if self.subscription_session is None:
+            session = self.new_session()
+            if not session.start():
+                raise ConnectionError('Failed to start the subscription session')
+            if not session.openService("//blp/mktdata"):
+                session.stop()
+                raise ConnectionError('Failed to open //blp/mktdata')
+
+            self.subscription_session = session
+            self.subscription_thread = threading.Thread(target=self.subscription_loop, args=(session,), daemon=True)
+            self.subscription_thread.start()
+
+        subscriptions = blpapi.SubscriptionList()
+        for ticker in tickers:
+            if ticker in self.buffers:
+                raise ValueError('{} is already subscribed'.format(ticker))
+
+            correlation_id = blpapi.CorrelationId(next(self.correlation_ids))
+            self.buffers[ticker] = RingBuffer(fields, size)
+            self.subscriptions[correlation_id.value()] = (ticker, [blpapi.Name(field) for field in fields], self.buffers[ticker])
+            subscriptions.add(ticker, fields, options, correlation_id)
+
+        self.subscription_session.subscribe(subscriptions)
         return None
 
-def IntradayBar(security, event, start_date, end_date, barInterval, other_param=None):
+    def unsubscribe(self, security=None):
+        '''
+        Cancel the subscriptions of security (a ticker or a list of tickers), all of them by default in which case
+        the subscription session is stopped
+        '''
+        if self.subscription_session is None:
+            return None
+
+        if security == None:
+            session, self.subscription_session = self.subscription_session, None
+            session.stop()
+            self.subscription_thread.join()
+            self.subscriptions.clear()
+            self.buffers.clear()
+            return None
+
+        tickers = [security] if type(security) == str else security
+        subscriptions = blpapi.SubscriptionList()
+        for value, (ticker, names, buffer) in list(self.subscriptions.items()):
+            if ticker in tickers:
+                subscriptions.add(ticker, correlationId=blpapi.CorrelationId(value))
+                del self.subscriptions[value]
+                del self.buffers[ticker]
+
+        self.subscription_session.unsubscribe(subscriptions)
+        return None
+
+    def snapshot(self, ticker, n=None, copy=False):
+        '''
+        Dataframe of the latest n updates received for ticker, made of views of its RingBuffer unless copy=True
+        '''
+        return self.buffers[ticker].snapshot(n, copy)
+
+    def subscription_loop(self, session):
+        # Runs in the subscription thread until the session is stopped by unsubscribe()
+        while self.subscription_session is session:
+            event = session.nextEvent(100)
+
+            if event.eventType() == blpapi.Event.SUBSCRIPTION_DATA:
+                self.process_subscription_event(event)
+            elif event.eventType() == blpapi.Event.SUBSCRIPTION_STATUS:
+                for msg in event:
+                    if msg.messageType() in (self.SUBSCRIPTION_FAILURE, self.SUBSCRIPTION_TERMINATED):
+                        ticker = self.subscription_ticker(msg)
+                        stats.logger.warning("SUBSCRIPTION FAILED: %s %s", ticker, msg.getElement(self.REASON))
+            elif event.eventType() == blpapi.Event.SESSION_STATUS:
+                for msg in event:
+                    if msg.messageType() == self.SESSION_TERMINATED:
+                        stats.logger.warning("Subscription session terminated")
+                        return None
+        return None
+
+    def subscription_ticker(self, msg):
+        for correlation_id in msg.correlationIds():
+            if correlation_id.value() in self.subscriptions:
+                return self.subscriptions[correlation_id.value()][0]
+        return None
+
+    def process_subscription_event(self, event):
+        time_update = np.datetime64(time.time_ns(), 'ns')  # Time of receipt
+
+        for msg in event:
+            if msg.messageType() != self.MARKET_DATA_EVENTS:
+                continue
+
+            for correlation_id in msg.correlationIds():
+                subscription = self.subscriptions.get(correlation_id.value())
+                if subscription is None:
+                    continue  # Late update of a cancelled subscription
+
+                ticker, names, buffer = subscription
+                values = []
+                for name in names:
+                    if msg.hasElement(name, True):
+                        value = msg.getElement(name).getValue()
+                        values.append(value if type(value) in (float, int) else np.nan)
+                    else:
+                        values.append(np.nan)
+
+                buffer.append(time_update, values)
+
+        return None
+
+class SessionPool():
+
+    '''
+    Keeps started BLP objects (session + opened services) alive between calls so that the
+    session start-up cost is only paid once. Sessions are health-checked when they are checked
+    out and are transparently restarted if they have been terminated.
+    '''
+
+    def __init__(self, max_size=4, session_options=None, session_factory=None, wait='blocking'):
+        check_wait(wait)
+        self.max_size = max_size
+        self.session_options = session_options
+        self.session_factory = session_factory
+        self.wait = wait  # Waiting strategy of the BLP objects, see BLP.__init__
+        self.idle = []  # Started BLP objects waiting to be reused
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(max_size)
+
+    @contextlib.contextmanager
+    def session(self):
+        '''
+        Context manager yielding a started BLP object for the exclusive use of the caller
+        This is a thread-safe method
+        '''
+        with self.slots:
+            bloomberg = self.checkout()
+            try:
+                yield bloomberg
+            except BaseException:
+                # The session may still hold events of the interrupted request, do not reuse it
+                bloomberg.stop()
+                raise
+            self.checkin(bloomberg)
+
+    def checkout(self):
+        with self.lock:
+            bloomberg = self.idle.pop() if self.idle else None
+
+        if bloomberg is None:
+            bloomberg = BLP(self.session_options, self.session_factory, wait=self.wait)
+        elif not bloomberg.check_session():
+            bloomberg.reconnect()
+
+        if not bloomberg.is_alive():
+            bloomberg.stop()  # The session may have been created even if it did not start
+            raise ConnectionError('Failed to start the Bloomberg session')
+
+        return bloomberg
+
+    def checkin(self, bloomberg):
+        if not bloomberg.is_alive():
+            bloomberg.stop()
+            return None
+
+        bloomberg.reset()
+        with self.lock:
+            self.idle.append(bloomberg)
+        return None
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for bloomberg in idle:
+            bloomberg.stop()
+        return None
+
+
+# Sessions shared by the module-level functions
+session_pool = SessionPool()
+atexit.register(session_pool.close)
+
+# Process-wide cache used by RefData(..., cache=True)
+refdata_cache = RefDataCache()
+
+# RequestScheduler shared by all the BLP objects (concurrency limit, priorities, data points rate), none by default
+scheduler = None
+
+# Field metadata used by RefData/HistoData(..., field_info=True), ~/.blp_pandas/fields.json
+field_cache = FieldCache()
+
+
+def IntradayBar(security, event, start_date, end_date, barInterval, other_param=None, max_in_flight=1, stream=False,
+                window=None, retries=0, compact=False, resume=3, sink=None, store=None):
 
     '''
     ────────────────────────────────────────────────────────────────────────────────────────────────
@@ -380,21 +1835,43 @@ def IntradayBar(security, event, start_date, end_date, barInterval, other_param=
                                           datetime(2018,11,22,17,30),
                                           1)
 
-    :return: pandas dataframe
+    max_in_flight > 1 sends the requests of all the tickers on one session at once (up to max_in_flight outstanding)
+    stream=True returns a generator yielding a dataframe chunk per PARTIAL_RESPONSE/RESPONSE event received
+    window (timedelta, multiple of barInterval) splits the date range into one request per window, the windows are
+    stitched back in order and the failed ones are sent again up to retries times
+    compact=True downcasts the integer columns ('float32' also stores the prices as float32), see compact_frame
+    resume: times the unfinished requests are sent again from the last bar received when the session terminates
+    sink (directory path or Sink) streams the bars into Parquet files partitioned by ticker and date, see sink.py
+    store (directory path or TickStore) serves the days already downloaded from disk and only requests the missing ones
+
+    :return: pandas dataframe (generator of pandas dataframes if stream=True, list of the files written if sink is given)
     '''
 
-    def get_tickerbar(ticker, event, start_date, end_date, barInterval, other_param):
+    def get_tickerbar(ticker, event, start_date, end_date, barInterval, other_param, max_in_flight, window, retries, compact,
+                      resume):
 
         '''
-        This nested function is called for each ticker so that the Bloomberg object is destroyed after each request
+        This nested function is called for each ticker with a session borrowed from the pool
         This is a thread-safe method
         '''
 
-        objBBG = BLP()  # Instantiate object with session
-        df_ticker = objBBG.get_intradaybar(ticker, event, start_date, end_date, barInterval, other_param)  # Get data in dataframe
+        with session_pool.session() as objBBG:
+            df_ticker = objBBG.get_intradaybar(ticker, event, start_date, end_date, barInterval, other_param, max_in_flight,
+                                               window, retries, compact, resume)  # Get data in dataframe
 
         return df_ticker
 
+    def stream_tickerbar(ticker, event, start_date, end_date, barInterval, other_param, max_in_flight, window, compact, resume):
+
+        '''
+        This nested generator keeps the session borrowed from the pool until the last chunk has been yielded
+        '''
+
+        with session_pool.session() as objBBG:
+            for df_chunk in objBBG.stream_intradaybar(ticker, event, start_date, end_date, barInterval, other_param,
+                                                      max_in_flight, window, compact, resume):
+                yield df_chunk
+
     #***************************
     # Check the input variables
     #***************************
@@ -413,24 +1890,59 @@ def IntradayBar(security, event, start_date, end_date, barInterval, other_param=
     if (type(event) != str):
         raise ValueError('The event has to be a string')
 
+    check_max_in_flight(max_in_flight)
+    check_window(window)
+    check_compact(compact)
+    check_resume(resume)
+    check_sink(sink)
+    check_store(store)
+
+    if (window != None) and (window % datetime.timedelta(minutes=barInterval) != datetime.timedelta(0)):
+        raise ValueError('The window has to be a multiple of the bar interval')
+
     # ***************************
     # Get data
     # ***************************
 
-    if type(security) == str:
+    if store != None:
+
+        store = TickStore(store) if type(store) == str else store
+        df_buffer = store.get_intraday('bars', [security] if type(security) == str else security, [event], start_date, end_date,
+                                       {'interval': barInterval, 'other_param': other_param},
+                                       lambda tickers, start, end: get_tickerbar(tickers, event, start, end, barInterval, other_param,
+                                                                                 max_in_flight, window, retries, False, resume))
+        df_buffer = compact_frame(df_buffer, compact == 'float32') if compact else df_buffer
+
+        return write_sink(sink, [df_buffer]) if sink != None else df_buffer
+
+    elif sink != None:
+
+        return write_sink(sink, stream_tickerbar(security, event, start_date, end_date, barInterval, other_param, max_in_flight,
+                                                 window, compact, resume))
+
+    elif stream:
 
-        return get_tickerbar(security,event, start_date, end_date, barInterval, other_param)
+        return stream_tickerbar(security, event, start_date, end_date, barInterval, other_param, max_in_flight, window, compact,
+                                resume)
+
+    elif (type(security) == str) or (max_in_flight > 1):
+
+        # Requests (per ticker and per window) are fanned out on one session and the responses routed back by correlation id
+        return get_tickerbar(security, event, start_date, end_date, barInterval, other_param, max_in_flight, window, retries,
+                             compact, resume)
 
     elif type(security) == list:
 
         listOfDataframes = []
         for ticker in security:
-            listOfDataframes.append(get_tickerbar(ticker, event, start_date, end_date, barInterval, other_param))
+            listOfDataframes.append(get_tickerbar(ticker, event, start_date, end_date, barInterval, other_param, 1,
+                                                  window, retries, compact, resume))
 
-        return pd.concat(listOfDataframes)
+        return concat_frames(listOfDataframes)
 
 
-def RefData(security, fields, overrides=None, other_param=None):
+def RefData(security, fields, overrides=None, other_param=None, cache=None, batch_size=None, max_fields=None, max_in_flight=1,
+            retries=0, compact=False, field_info=None, sink=None):
 
     '''
     ────────────────────────────────────────────────────────────────────────────────────────────────
@@ -440,10 +1952,98 @@ def RefData(security, fields, overrides=None, other_param=None):
                                      'EQY_WEIGHTED_AVG_PX',
                                      {'VWAP_START_TIME': '9:30','VWAP_END_TIME': '11:30'})
 
+    cache=True serves the cells fetched recently from the process-wide refdata_cache (a RefDataCache can also be given)
+    and only requests the missing ones, concurrent callers share the requests in flight
+    batch_size/max_fields split large universes into batches of securities/fields sent concurrently (up to max_in_flight),
+    the failed batches are sent again on their own up to retries times
+    compact=True downcasts the integer columns ('float32' also stores the floats as float32) and skips the fillna copy
+    field_info=True decodes the fields with typed getters into typed columns chosen from their //blp/apiflds metadata,
+    looked up once and kept on disk by field_cache (a FieldCache can also be given)
+    The bulk fields (INDX_MEMBERS, DVD_HIST_ALL...) are requested with BulkData
+    sink (directory path or Sink) writes the frame into Parquet files partitioned by ticker, see sink.py
+
+    :return: pandas dataframe (list of the files written if sink is given)
+    '''
+
+    def get_ref(security, fields, compact=False):
+        # The cached cells are fetched without compact so that they keep their full precision
+        with session_pool.session() as bloomberg:
+            return bloomberg.get_refdata(security, fields, overrides, other_param, batch_size, max_fields, max_in_flight, retries,
+                                         compact, field_info)
+
+
+    #***************************
+    # Check the input variables
+    #***************************
+
+    check_overrides(overrides)
+    check_other_param(other_param)
+
+    if (type(security) != str) and (type(security) != list):
+        raise ValueError('The security parameter has to be a string or a list')
+
+    if type(security) == str:
+        security = [security]
+
+    if (type(fields) != str) and (type(fields) != list):
+        raise ValueError('The fields parameter has to be a string or a list')
+
+    if type(fields) == str:
+        fields = [fields]
+
+    if (cache != None) and (type(cache) != bool) and (not isinstance(cache, RefDataCache)):
+        raise ValueError('The cache has to be a boolean or a RefDataCache')
+
+    for batch_value in (batch_size, max_fields):
+        if (batch_value != None) and ((type(batch_value) != int) or (batch_value < 1)):
+            raise ValueError('The batch_size and max_fields parameters have to be integers greater than 1')
+
+    check_max_in_flight(max_in_flight)
+    check_compact(compact)
+    check_field_info(field_info)
+    check_sink(sink)
+
+    # ***************************
+    # Get data
+    # ***************************
+
+    if field_info == True:
+        field_info = field_cache
+    elif field_info == False:
+        field_info = None
+
+    if cache == True:
+        cache = refdata_cache
+
+    if isinstance(cache, RefDataCache):
+        df_buffer = cache.get_refdata(security, fields, overrides, other_param, get_ref)
+        df_buffer = compact_frame(df_buffer, compact == 'float32') if compact else df_buffer
+    else:
+        df_buffer = get_ref(security, fields, compact)
+
+    if sink != None:
+        return write_sink(sink, [df_buffer.rename_axis('ticker')], partition_by=('ticker',))
+
+    return df_buffer
+
+
+def BulkData(security, fields, overrides=None, other_param=None, batch_size=None, max_fields=None, max_in_flight=1, retries=0,
+             sink=None):
 
-    :return: pandas dataframe
     '''
+    ────────────────────────────────────────────────────────────────────────────────────────────────
+    ┌─────────┐     from blp_pandas import blp_pandas as bbg
+    │ Example │
+    └─────────┘     df = bbg.BulkData(['CAC Index', 'SX5E Index'], 'INDX_MEMBERS')
+
+                    df = bbg.BulkData('FP FP Equity', 'DVD_HIST_ALL', {'DVD_START_DT': '20100101'})
 
+    The bulk values of all the securities are decoded straight into columns, one row per row of a bulk value and
+    one column per sub-element. The request is batched like RefData (batch_size, max_fields, max_in_flight, retries).
+    sink (directory path or Sink) writes the frame into Parquet files partitioned by ticker, see sink.py
+
+    :return: pandas dataframe with a Multi-index (ticker/field/row) (list of the files written if sink is given)
+    '''
 
     #***************************
     # Check the input variables
@@ -464,17 +2064,29 @@ def RefData(security, fields, overrides=None, other_param=None):
     if type(fields) == str:
         fields = [fields]
 
+    for batch_value in (batch_size, max_fields):
+        if (batch_value != None) and ((type(batch_value) != int) or (batch_value < 1)):
+            raise ValueError('The batch_size and max_fields parameters have to be integers greater than 1')
+
+    check_max_in_flight(max_in_flight)
+    check_sink(sink)
 
     # ***************************
     # Get data
     # ***************************
 
-    bloomberg = BLP()
+    with session_pool.session() as bloomberg:
+        df_buffer = bloomberg.get_bulkdata(security, fields, overrides, other_param, batch_size, max_fields, max_in_flight,
+                                           retries)
 
-    return bloomberg.get_refdata(security, fields, overrides, other_param)
+    if sink != None:
+        return write_sink(sink, [df_buffer], partition_by=('ticker',))
 
+    return df_buffer
 
-def IntradayTick(security, list_events, start_date, end_date, condition_codes=True,  other_param=None):
+
+def IntradayTick(security, list_events, start_date, end_date, condition_codes=True,  other_param=None, max_in_flight=1,
+                 stream=False, window=None, retries=0, compact=False, resume=3, sink=None, store=None):
 
     '''
     ────────────────────────────────────────────────────────────────────────────────────────────────
@@ -487,19 +2099,40 @@ def IntradayTick(security, list_events, start_date, end_date, condition_codes=Tr
                                           datetime(2018,11,22,17,30),
                                           other_param = {'includeNativeTradeId': True})
 
-    :return: dataframe
+    max_in_flight > 1 sends the requests of all the tickers on one session at once (up to max_in_flight outstanding)
+    stream=True returns a generator yielding a dataframe chunk per PARTIAL_RESPONSE/RESPONSE event received
+    window (timedelta) splits the date range into one request per window, the windows are stitched back in order
+    (without the duplicated ticks at the boundaries) and the failed ones are sent again up to retries times
+    compact=True makes the condition codes categorical and downcasts the size ('float32' also stores the values as float32)
+    resume: times the unfinished requests are sent again from the last tick received when the session terminates
+    sink (directory path or Sink) streams the ticks into Parquet files partitioned by ticker and date, see sink.py
+    store (directory path or TickStore) serves the days already downloaded from disk and only requests the missing ones
+
+    :return: dataframe (generator of dataframes if stream=True, list of the files written if sink is given)
     '''
 
-    def get_tickertick(ticker, list_events, start_date, end_date, condition_codes, other_param):
+    def get_tickertick(ticker, list_events, start_date, end_date, condition_codes, other_param, max_in_flight, window, retries,
+                       compact, resume):
         '''
-        This nested function is called for each ticker so that the Bloomberg object is destroyed after each request
+        This nested function is called for each ticker with a session borrowed from the pool
         This is a thread-safe method
         Returns a pandas dataframe
         '''
 
-        objBBG = BLP()  # Instantiate object with session
+        with session_pool.session() as objBBG:
+            return objBBG.get_intradaytick(ticker, list_events, start_date, end_date, condition_codes, other_param, max_in_flight,
+                                           window, retries, compact, resume)
+
+    def stream_tickertick(ticker, list_events, start_date, end_date, condition_codes, other_param, max_in_flight, window, compact,
+                          resume):
+        '''
+        This nested generator keeps the session borrowed from the pool until the last chunk has been yielded
+        '''
 
-        return objBBG.get_intradaytick(ticker, list_events, start_date, end_date, condition_codes, other_param)
+        with session_pool.session() as objBBG:
+            for df_chunk in objBBG.stream_intradaytick(ticker, list_events, start_date, end_date, condition_codes, other_param,
+                                                       max_in_flight, window, compact, resume):
+                yield df_chunk
 
 
     #***************************
@@ -516,23 +2149,93 @@ def IntradayTick(security, list_events, start_date, end_date, condition_codes=Tr
     if (type(list_events) == str):
         list_events = [list_events]
 
+    check_max_in_flight(max_in_flight)
+    check_window(window)
+    check_compact(compact)
+    check_resume(resume)
+    check_sink(sink)
+    check_store(store)
+
     # ***************************
     # Get data
     # ***************************
 
-    if type(security) == str:
-        return getTickerTick(security, list_events, start_date, end_date, condition_codes, other_param)
+    if store != None:
+        store = TickStore(store) if type(store) == str else store
+        df_buffer = store.get_intraday('ticks', [security] if type(security) == str else security, list_events, start_date,
+                                       end_date, {'condition_codes': condition_codes, 'other_param': other_param},
+                                       lambda tickers, start, end: get_tickertick(tickers, list_events, start, end, condition_codes,
+                                                                                  other_param, max_in_flight, window, retries, False,
+                                                                                  resume))
+        df_buffer = compact_frame(df_buffer, compact == 'float32') if compact else df_buffer
+        return write_sink(sink, [df_buffer]) if sink != None else df_buffer
+
+    elif sink != None:
+        return write_sink(sink, stream_tickertick(security, list_events, start_date, end_date, condition_codes, other_param,
+                                                  max_in_flight, window, compact, resume))
+
+    elif stream:
+        return stream_tickertick(security, list_events, start_date, end_date, condition_codes, other_param, max_in_flight, window,
+                                 compact, resume)
+
+    elif (type(security) == str) or (max_in_flight > 1):
+        # Requests (per ticker and per window) are fanned out on one session and the responses routed back by correlation id
+        return get_tickertick(security, list_events, start_date, end_date, condition_codes, other_param, max_in_flight,
+                              window, retries, compact, resume)
 
     elif type(security) == list:
         listOfDataframes = []
 
         for ticker in security:
-            listOfDataframes.append(get_tickertick(ticker, list_events, start_date, end_date, condition_codes, other_param))
+            listOfDataframes.append(get_tickertick(ticker, list_events, start_date, end_date, condition_codes, other_param, 1,
+                                                   window, retries, compact, resume))
 
-        return pd.concat(listOfDataframes)
+        return concat_frames(listOfDataframes)
 
 
-def HistoData(security, fields, start_date, end_date, overrides=None, other_param=None):
+def IntradayBarGrid(security, list_events, start_date, end_date, intervals, other_param=None, max_in_flight=1,
+                    window=None, retries=0):
+
+    '''
+    ────────────────────────────────────────────────────────────────────────────────────────────────
+    ┌─────────┐     from blp_pandas import blp_pandas as bbg
+    │ Example │
+    └─────────┘     dict_bars = bbg.IntradayBarGrid(['CAC FP Equity', 'CACX LN Equity'],
+                                                    ['TRADE', 'BID'],
+                                                    datetime(2018,11,22,9,0),
+                                                    datetime(2018,11,22,17,30),
+                                                    [1, 5, 15, 60])
+
+                    df = dict_bars[('TRADE', 5)]
+
+    The ticks are pulled once with IntradayTick (max_in_flight, window and retries are passed to it) and the bars of
+    every event type and interval (in minutes) are computed locally, see bars.tick_bars.
+    The bars start at start_date + k * interval and the intervals without ticks are skipped.
+
+    :return: dictionary (event, interval) -> pandas dataframe with the columns of IntradayBar
+    '''
+
+    #***************************
+    # Check the input variables
+    #***************************
+
+    if (type(list_events) == str):
+        list_events = [list_events]
+
+    check_intervals(intervals)
+
+    # ***************************
+    # Get data
+    # ***************************
+
+    df_ticks = IntradayTick(security, list_events, start_date, end_date, condition_codes=False, other_param=other_param,
+                            max_in_flight=max_in_flight, window=window, retries=retries)
+
+    return tick_bars(df_ticks, intervals, start_date, list_events)
+
+
+def HistoData(security, fields, start_date, end_date, overrides=None, other_param=None, cache=None, layout='long', compact=False,
+              field_info=None, sink=None):
 
     '''
     ────────────────────────────────────────────────────────────────────────────────────────────────
@@ -542,10 +2245,22 @@ def HistoData(security, fields, start_date, end_date, overrides=None, other_para
                                        datetime(2018,1,1),
                                        datetime(2018,12,31))
 
-    :return: pandas dataframe
+    cache (directory path or HistoCache) serves the dates already downloaded from disk and only requests the missing ones
+    layout='wide' returns one row per date and (field, ticker) columns instead of the (date, ticker) Multi-index
+    compact=True downcasts the integer columns ('float32' also stores the floats as float32)
+    field_info=True decodes the fields into typed columns chosen from their //blp/apiflds metadata, see RefData
+    sink (directory path or Sink) writes the long layout into Parquet files partitioned by ticker and year, see sink.py
+
+    :return: pandas dataframe (list of the files written if sink is given)
 
     '''
 
+    def get_histo(security, fields, start_date, end_date, layout='long', compact=False):
+        # The cached series are fetched without compact so that they keep their full precision
+        with session_pool.session() as bloomberg:
+            return bloomberg.get_histodata(security, fields, start_date, end_date, overrides, other_param, layout, compact,
+                                           field_info)
+
 
     #***************************
     # Check the input variables
@@ -568,13 +2283,39 @@ def HistoData(security, fields, start_date, end_date, overrides=None, other_para
     if type(fields) == str:
         fields = [fields]
 
+    if (cache != None) and (type(cache) != str) and (not isinstance(cache, HistoCache)):
+        raise ValueError('The cache has to be a directory path or a HistoCache')
+
+    if layout not in ('long', 'wide'):
+        raise ValueError("The layout has to be 'long' or 'wide'")
+
+    check_compact(compact)
+    check_field_info(field_info)
+    check_sink(sink)
+
     # ***************************
     # Get data
     # ***************************
 
-    bloomberg = BLP()
+    if field_info == True:
+        field_info = field_cache
+    elif field_info == False:
+        field_info = None
+
+    if type(cache) == str:
+        cache = HistoCache(cache)
+
+    if sink != None:
+        # The sink is given the long layout, one row per (date, ticker)
+        return write_sink(sink, [HistoData(security, fields, start_date, end_date, overrides, other_param, cache, 'long', compact,
+                                           field_info)], partition_by=('ticker', 'year'))
+
+    if cache != None:
+        df_buffer = cache.get_histodata(security, fields, start_date, end_date, overrides, other_param, get_histo)
+        df_buffer = df_buffer.unstack('ticker') if layout == 'wide' else df_buffer
+        return compact_frame(df_buffer, compact == 'float32') if compact else df_buffer
 
-    return bloomberg.get_histodata(security, fields, start_date, end_date, overrides, other_param)
+    return get_histo(security, fields, start_date, end_date, layout, compact)
 
 
 __copyright__ = """
@@ -0,0 +1,554 @@
+import collections
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from .lazy import lazy_import
+
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
+
+ONE_DAY = datetime.timedelta(days=1)
+
+
+def tmp_path_of(path):
+    # Unique per process and per write, the caches can be shared by several processes
+    return '{}.{}.{}.tmp'.format(path, os.getpid(), uuid.uuid4().hex)
+
+
+def missing_ranges(covered, start, end):
+    '''
+    Date ranges of start..end (inclusive) that are not in the list of covered (start, end) ranges
+    '''
+    missing = []
+    cursor = start
+
+    for range_start, range_end in sorted(covered):
+        if range_end < cursor:
+            continue
+        if range_start > end:
+            break
+        if range_start > cursor:
+            missing.append((cursor, range_start - ONE_DAY))
+        cursor = max(cursor, range_end + ONE_DAY)
+
+    if cursor <= end:
+        missing.append((cursor, end))
+
+    return missing
+
+
+def merge_ranges(covered, start, end):
+    '''
+    Union of the covered ranges and start..end, overlapping or adjacent ranges are merged
+    '''
+    merged = []
+    for range_start, range_end in sorted(covered + [(start, end)]):
+        if merged and range_start <= merged[-1][1] + ONE_DAY:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], range_end))
+        else:
+            merged.append((range_start, range_end))
+    return merged
+
+
+class HistoCache():
+
+    '''
+    Persistent on-disk cache of HistoData results (requires pyarrow)
+    Each (security, field, overrides, other_param) series is stored in its own Parquet file and an index keeps
+    track of the date ranges already downloaded, so that only the missing ranges are requested from Bloomberg.
+    Today is never flagged as downloaded since its values can still change.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+        self.index_path = os.path.join(path, 'index.json')
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+
+    def key(self, security, field, overrides, other_param):
+        options = json.dumps([security, field, overrides, other_param], sort_keys=True, default=str)
+        return hashlib.sha1(options.encode('utf-8')).hexdigest()
+
+    def covered(self, key):
+        entry = self.index.get(key)
+        if entry == None:
+            return []
+        return [(datetime.date.fromisoformat(start), datetime.date.fromisoformat(end)) for start, end in entry['covered']]
+
+    def save_index(self):
+        # Written to a temporary file first so that a crash cannot leave a truncated index
+        tmp_path = tmp_path_of(self.index_path)
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+        return None
+
+    def read(self, key):
+        file_path = os.path.join(self.path, key + '.parquet')
+        if not os.path.exists(file_path):
+            return pd.Series(dtype=np.float64, index=pd.DatetimeIndex([]))
+        return pd.read_parquet(file_path)['value']
+
+    def write(self, key, series):
+        file_path = os.path.join(self.path, key + '.parquet')
+        tmp_path = tmp_path_of(file_path)
+        pd.DataFrame({'value': series}).to_parquet(tmp_path)
+        os.replace(tmp_path, file_path)
+        return None
+
+    def get_histodata(self, security, fields, start_date, end_date, overrides, other_param, fetch):
+        '''
+        Same output as BLP.get_histodata, fetch(security, fields, start_date, end_date) is only called for the missing ranges
+        '''
+        start, end = start_date.date(), end_date.date()
+        last_complete_day = datetime.date.today() - ONE_DAY
+
+        # Group the missing (security, field) series by missing range so that they share requests
+        dict_missing = {}
+        for ticker in security:
+            for field in fields:
+                key = self.key(ticker, field, overrides, other_param)
+                for missing in missing_ranges(self.covered(key), start, end):
+                    tickers, list_fields = dict_missing.setdefault(missing, ([], []))
+                    if ticker not in tickers:
+                        tickers.append(ticker)
+                    if field not in list_fields:
+                        list_fields.append(field)
+
+        for (missing_start, missing_end), (tickers, list_fields) in dict_missing.items():
+            df_missing = fetch(tickers,
+                               list_fields,
+                               datetime.datetime.combine(missing_start, datetime.time()),
+                               datetime.datetime.combine(missing_end, datetime.time()))
+            self.merge(df_missing, tickers, list_fields, missing_start, min(missing_end, last_complete_day),
+                       overrides, other_param)
+
+        return self.load(security, fields, start, end, overrides, other_param)
+
+    def merge(self, df_missing, tickers, fields, start, end, overrides, other_param):
+        # Store the downloaded series and flag start..end as covered, the tickers whose request failed are requested again next time
+        failed = df_missing.attrs.get('failed', [])
+        with self.lock:
+            for ticker in tickers:
+                if ticker in failed:
+                    continue
+                elif ticker in df_missing.index.get_level_values('ticker'):
+                    df_ticker = df_missing.xs(ticker, level='ticker')
+                    df_ticker.index = pd.to_datetime(df_ticker.index)
+                else:
+                    df_ticker = pd.DataFrame(columns=fields, index=pd.DatetimeIndex([]))
+
+                for field in fields:
+                    key = self.key(ticker, field, overrides, other_param)
+                    series = df_ticker[field].dropna()
+
+                    if len(series):
+                        stored = self.read(key)
+                        series = pd.concat([stored[~stored.index.isin(series.index)], series]).sort_index()
+                        self.write(key, series)
+
+                    if start <= end:
+                        covered = merge_ranges(self.covered(key), start, end)
+                        self.index[key] = {'security': ticker,
+                                           'field': field,
+                                           'covered': [[range_start.isoformat(), range_end.isoformat()] for range_start, range_end in covered]}
+
+            self.save_index()
+
+        return None
+
+    def load(self, security, fields, start, end, overrides, other_param):
+        # Returns a pandas dataframe with a Multi-index (date/ticker) like BLP.get_histodata
+        list_df_buffer = []
+        for ticker in security:
+            dict_series = {}
+            for field in fields:
+                series = self.read(self.key(ticker, field, overrides, other_param))
+                dict_series[field] = series[(series.index >= pd.Timestamp(start)) & (series.index <= pd.Timestamp(end))]
+
+            df_ticker = pd.DataFrame(dict_series, columns=fields)
+            if len(df_ticker):
+                df_ticker.index = pd.MultiIndex.from_arrays([df_ticker.index, [ticker] * len(df_ticker)], names=['date', 'ticker'])
+                list_df_buffer.append(df_ticker)
+
+        if not list_df_buffer:
+            return pd.DataFrame(columns=fields, index=pd.MultiIndex.from_arrays([pd.DatetimeIndex([]), []], names=['date', 'ticker']))
+
+        return pd.concat(list_df_buffer).fillna(value=np.nan)
+
+
+class RefDataCache():
+
+    '''
+    Process-wide in-memory cache of RefData cells (security, field, overrides, other_param)
+    The number of cells is bounded (least recently used cells are evicted first) and each cell expires after the ttl
+    of its field (ttl is a dictionary field -> seconds, default_ttl is used for the other fields).
+    Concurrent callers asking for the same cells share a single in-flight request.
+    '''
+
+    def __init__(self, max_size=100000, default_ttl=60, ttl=None):
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self.ttl = ttl if ttl != None else {}
+        self.cells = collections.OrderedDict()  # cell -> (value, expiry time)
+        self.in_flight = {}  # cell -> threading.Event set once the request fetching it is over
+        self.lock = threading.Lock()
+
+    def clear(self):
+        with self.lock:
+            self.cells.clear()
+        return None
+
+    def options(self, overrides, other_param):
+        return json.dumps([overrides, other_param], sort_keys=True, default=str)
+
+    def lookup(self, cell, now):
+        # Must be called with the lock held, returns (True, value) for a fresh cell
+        if cell in self.cells:
+            value, expiry = self.cells[cell]
+            if expiry > now:
+                self.cells.move_to_end(cell)
+                return True, value
+            del self.cells[cell]
+        return False, None
+
+    def store(self, cell, value, now):
+        # Must be called with the lock held
+        self.cells[cell] = (value, now + self.ttl.get(cell[1], self.default_ttl))
+        self.cells.move_to_end(cell)
+        while len(self.cells) > self.max_size:
+            self.cells.popitem(last=False)
+        return None
+
+    def get_refdata(self, security, fields, overrides, other_param, fetch):
+        '''
+        Same output as BLP.get_refdata, fetch(security, fields) is only called for the cells that are neither cached nor in flight
+        '''
+        options = self.options(overrides, other_param)
+        dictData = {ticker: {} for ticker in security}
+        owned, waiting = [], []
+
+        with self.lock:
+            now = time.monotonic()
+            for ticker in security:
+                for field in fields:
+                    cell = (ticker, field, options)
+                    found, value = self.lookup(cell, now)
+                    if found:
+                        dictData[ticker][field] = value
+                    elif cell in self.in_flight:
+                        waiting.append((cell, self.in_flight[cell]))
+                    elif cell not in owned:
+                        self.in_flight[cell] = threading.Event()
+                        owned.append(cell)
+
+        try:
+            self.fetch_cells(owned, fetch, dictData)
+        finally:
+            with self.lock:
+                for cell in owned:
+                    self.in_flight.pop(cell).set()
+
+        # Cells requested by another caller, fetched again if that request failed
+        failed = []
+        for cell, event in waiting:
+            event.wait()
+            with self.lock:
+                found, value = self.lookup(cell, time.monotonic())
+            if found:
+                dictData[cell[0]][cell[1]] = value
+            else:
+                failed.append(cell)
+
+        self.fetch_cells(failed, fetch, dictData)
+
+        df_buffer = pd.DataFrame.from_dict({ticker: [dictData[ticker].get(field) for field in fields] for ticker in dictData},
+                                           orient='index',
+                                           columns=fields)
+
+        return df_buffer.fillna(value=np.nan)
+
+    def fetch_cells(self, cells, fetch, dictData):
+        # Securities missing the same fields share one request
+        dict_requests = collections.OrderedDict()
+        for ticker, field, options in cells:
+            dict_requests.setdefault(ticker, []).append(field)
+
+        dict_groups = collections.OrderedDict()
+        for ticker, list_fields in dict_requests.items():
+            dict_groups.setdefault(tuple(list_fields), []).append(ticker)
+
+        for list_fields, tickers in dict_groups.items():
+            df_missing = fetch(tickers, list(list_fields))
+            failed = df_missing.attrs.get('failed', [])  # Not cached so that the next callers request them again
+
+            with self.lock:
+                now = time.monotonic()
+                for ticker in tickers:
+                    for field in list_fields:
+                        if ticker in df_missing.index:
+                            value = df_missing.at[ticker, field]
+                        else:
+                            value = np.nan
+                        dictData[ticker][field] = value
+                        if ticker not in failed:
+                            self.store((ticker, field, cells[0][2]), value, now)
+
+        return None
+
+
+class FieldCache():
+
+    '''
+    Persistent cache of the //blp/apiflds metadata of the fields ({'datatype': ..., 'ftype': ...}) stored in a json file,
+    each field is only looked up once (the unknown ones are remembered as None)
+    The file is read on first use, ~/.blp_pandas/fields.json by default
+    '''
+
+    def __init__(self, path=None):
+        self.path = path if path != None else os.path.join(os.path.expanduser('~'), '.blp_pandas', 'fields.json')
+        self.fields = None  # Upper case mnemonic -> metadata
+        self.lock = threading.Lock()
+
+    def load(self):
+        # Must be called with the lock held
+        if self.fields == None:
+            self.fields = {}
+            if os.path.exists(self.path):
+                with open(self.path) as f:
+                    self.fields = json.load(f)
+        return self.fields
+
+    def save(self):
+        # Must be called with the lock held, written to a temporary file first like HistoCache.save_index
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = tmp_path_of(self.path)
+        with open(tmp_path, 'w') as f:
+            json.dump(self.fields, f)
+        os.replace(tmp_path, self.path)
+        return None
+
+    def clear(self):
+        with self.lock:
+            self.fields = {}
+            self.save()
+        return None
+
+    def get_fields(self, fields, fetch):
+        '''
+        Dictionary field -> metadata (None for the unknown fields), fetch(fields) is only called for the fields not cached yet
+        and returns a dictionary upper case mnemonic -> metadata, the fields it does not return are not cached
+        '''
+        with self.lock:
+            missing = [field for field in fields if field.upper() not in self.load()]
+
+        if missing:
+            dict_info = fetch(missing)
+            with self.lock:
+                for field in missing:
+                    if field.upper() in dict_info:
+                        self.fields[field.upper()] = dict_info[field.upper()]
+                self.save()
+
+        with self.lock:
+            return {field: self.fields.get(field.upper()) for field in fields}
+
+
+def day_runs(days):
+    # Runs of consecutive days as (first day, last day)
+    runs = []
+    for day in days:
+        if runs and day == runs[-1][1] + ONE_DAY:
+            runs[-1] = (runs[-1][0], day)
+        else:
+            runs.append((day, day))
+    return runs
+
+
+def slice_time(df_long, low, high, inclusive=False):
+    # Rows of a frame sorted by time with low <= time < high (time <= high if inclusive)
+    times = df_long['time'].to_numpy()
+    i = np.searchsorted(times, np.datetime64(low), side='left')
+    j = np.searchsorted(times, np.datetime64(high), side='right' if inclusive else 'left')
+    return df_long.iloc[i:j]
+
+
+class TickStore():
+
+    '''
+    Append-only local store of the IntradayTick/IntradayBar results, one partition per (security, event type, day)
+    A partition is a directory of .npy columns sorted by time (the text columns are stored as int32 codes next to their
+    categories) that is never modified once written. The partitions are read memory-mapped and only the rows of the
+    requested time range are copied, found by binary search on the time column.
+    The missing days are requested whole (midnight to midnight GMT) and stored, the result is then sliced to the
+    requested range. The days that are not over yet (today) are requested as asked every time and never stored.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+        self.index_path = os.path.join(path, 'index.json')
+        self.index = {}  # Key -> {'security', 'event', 'days'}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+
+    def key(self, kind, security, event, options):
+        options = json.dumps([kind, security, event, options], sort_keys=True, default=str)
+        return hashlib.sha1(options.encode('utf-8')).hexdigest()
+
+    def is_stored(self, key, day):
+        return day.isoformat() in self.index.get(key, {}).get('days', [])
+
+    def partition_path(self, key, day):
+        return os.path.join(self.path, key, day.isoformat())
+
+    def save_index(self):
+        # Must be called with the lock held, written to a temporary file first like HistoCache.save_index
+        tmp_path = tmp_path_of(self.index_path)
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+        return None
+
+    def write_partition(self, key, day, df_day, security, event):
+        # Must be called with the lock held, the partition is written in a temporary directory and renamed once complete
+        partition_path = self.partition_path(key, day)
+        tmp_path = tmp_path_of(partition_path)
+        os.makedirs(tmp_path, exist_ok=True)
+
+        columns = []
+        for column in df_day.columns:
+            values = df_day[column]
+            if values.dtype.kind in 'biufmM':
+                np.save(os.path.join(tmp_path, column + '.npy'), values.to_numpy())
+                columns.append([column, None])
+            else:
+                codes, uniques = pd.factorize(values)
+                np.save(os.path.join(tmp_path, column + '.npy'), codes.astype(np.int32))
+                columns.append([column, [str(value) for value in uniques]])
+
+        with open(os.path.join(tmp_path, 'columns.json'), 'w') as f:
+            json.dump({'rows': len(df_day), 'columns': columns}, f)
+
+        try:
+            os.replace(tmp_path, partition_path)
+        except OSError:
+            shutil.rmtree(tmp_path)  # Already written by another process, or by a run that stopped before saving the index
+
+        entry = self.index.setdefault(key, {'security': security, 'event': event, 'days': []})
+        if day.isoformat() not in entry['days']:
+            entry['days'].append(day.isoformat())
+        return None
+
+    def read_partition(self, key, day, low, high, inclusive=False):
+        # Rows of a partition with low <= time < high (time <= high if inclusive)
+        partition_path = self.partition_path(key, day)
+        with open(os.path.join(partition_path, 'columns.json')) as f:
+            layout = json.load(f)
+
+        # Empty arrays cannot be memory-mapped
+        mmap_mode = 'r' if layout['rows'] else None
+        times = np.load(os.path.join(partition_path, 'time.npy'), mmap_mode=mmap_mode)
+        i = np.searchsorted(times, np.datetime64(low), side='left')
+        j = np.searchsorted(times, np.datetime64(high), side='right' if inclusive else 'left')
+
+        data = {}
+        for column, categories in layout['columns']:
+            values = np.array(np.load(os.path.join(partition_path, column + '.npy'), mmap_mode=mmap_mode)[i:j])
+            if categories is not None:
+                lookup = np.empty(len(categories) + 1, dtype=object)
+                lookup[:len(categories)] = categories
+                lookup[-1] = np.nan
+                values = lookup[values]
+            data[column] = values
+        return pd.DataFrame(data)
+
+    def get_intraday(self, kind, security, events, start_date, end_date, options, fetch):
+        '''
+        Same output as BLP.get_intradaytick (kind='ticks', one partition per event type) or BLP.get_intradaybar
+        (kind='bars', events is [event]), options are the other parameters of the request (condition codes, interval...)
+        fetch(tickers, start, end) is only called for the days that are not stored
+        '''
+        days = [start_date.date() + i * ONE_DAY for i in range((end_date.date() - start_date.date()).days + 1)]
+        days = [day for day in days if datetime.datetime.combine(day, datetime.time()) < end_date] or days[:1]
+        last_complete_day = datetime.datetime.now(datetime.timezone.utc).date() - ONE_DAY
+
+        # Group the tickers by run of missing days so that they share requests
+        dict_missing = collections.OrderedDict()
+        for ticker in security:
+            keys = [self.key(kind, ticker, event, options) for event in events]
+            missing = [day for day in days if not all(self.is_stored(key, day) for key in keys)]
+            for run in day_runs(missing):
+                dict_missing.setdefault(run, []).append(ticker)
+
+        fetched = {}  # (ticker, day) -> rows of the day that were requested
+        for (first_day, last_day), tickers in dict_missing.items():
+            # The complete days are requested from midnight to midnight so that they can be stored whole, the result is
+            # sliced to the requested range below
+            fetch_start = datetime.datetime.combine(first_day, datetime.time())
+            if first_day > last_complete_day:
+                fetch_start = max(start_date, fetch_start)
+            fetch_end = datetime.datetime.combine(last_day + ONE_DAY, datetime.time())
+            if last_day > last_complete_day:
+                fetch_end = min(end_date, fetch_end)
+            df_missing = fetch(tickers, fetch_start, fetch_end)
+            failed = df_missing.attrs.get('failed', [])  # Their days are not written, see BLP.failed_tickers
+            df_missing = df_missing.reset_index()
+
+            with self.lock:
+                for ticker in tickers:
+                    df_ticker = df_missing[df_missing['ticker'] == ticker]
+                    for i in range((last_day - first_day).days + 1):
+                        day = first_day + i * ONE_DAY
+                        day_start = datetime.datetime.combine(day, datetime.time())
+                        fetched[(ticker, day)] = slice_time(df_ticker, day_start, day_start + ONE_DAY, day_start + ONE_DAY >= end_date)
+
+                        complete = (fetch_start <= day_start) and (day_start + ONE_DAY <= fetch_end) and (day <= last_complete_day)
+                        if complete and (ticker not in failed):
+                            df_day = slice_time(df_ticker, day_start, day_start + ONE_DAY)
+                            for event in events:
+                                df_event = df_day[df_day['type'] == event] if kind == 'ticks' else df_day
+                                self.write_partition(self.key(kind, ticker, event, options), day,
+                                                     df_event.drop(columns=['ticker', 'type'], errors='ignore'), ticker, event)
+                self.save_index()
+
+        list_df_buffer = []
+        for ticker in security:
+            for day in days:
+                day_start = datetime.datetime.combine(day, datetime.time())
+                low, high = max(start_date, day_start), min(end_date, day_start + ONE_DAY)
+                inclusive = high == end_date
+
+                if (ticker, day) in fetched:
+                    list_df_buffer.append(slice_time(fetched[(ticker, day)], low, high, inclusive))
+                    continue
+
+                list_df_event = []
+                for event in events:
+                    df_event = self.read_partition(self.key(kind, ticker, event, options), day, low, high, inclusive)
+                    if kind == 'ticks':
+                        df_event.insert(1, 'type', event)
+                    list_df_event.append(df_event)
+
+                # The ticks of the event types are merged back in time order
+                df_day = pd.concat(list_df_event, ignore_index=True).sort_values('time', kind='stable')
+                df_day.insert(1, 'ticker', ticker)
+                list_df_buffer.append(df_day)
+
+        df_buffer = pd.concat(list_df_buffer, ignore_index=True)
+        if kind == 'ticks':
+            df_buffer['type'] = pd.Categorical(df_buffer['type'], categories=events)
+        return df_buffer.set_index(['time', 'ticker'])
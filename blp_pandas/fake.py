@@ -0,0 +1,495 @@
+import collections
+import datetime
+import random
+import threading
+import time
+from .lazy import lazy_import
+
+blpapi = lazy_import('blpapi')
+
+__doc__ = """
+Local stand-in for blpapi.Session used to exercise BLP, eventLoop and the process_msg_* decoders offline
+
+from blp_pandas import blp_pandas as bbg
+from blp_pandas.fake import FakeSession
+
+bloomberg = bbg.BLP(session_factory=FakeSession)
+pool = bbg.SessionPool(session_factory=lambda options: FakeSession(options, rows_per_message=500))
+
+The requests are answered with PARTIAL_RESPONSE/RESPONSE events shaped like the //blp/refdata responses,
+the responses of several requests in flight are interleaved like they would be by the server.
+The //blp/mktdata subscriptions receive a SUBSCRIPTION_DATA event in turn whenever no response is pending.
+Given an eventHandler, the events are handed to it from a dispatcher thread like blpapi.Session(options, eventHandler) does.
+"""
+
+
+# Bulk fields answered with bulk_rows rows of these sub-elements, the other fields are prices
+BULK_FIELDS = {'INDX_MEMBERS': ['Member Ticker and Exchange Code'],
+               'OPT_CHAIN': ['Security Description'],
+               'DVD_HIST_ALL': ['Declared Date', 'Ex-Date', 'Record Date', 'Payable Date', 'Dividend Amount',
+                                'Dividend Frequency', 'Dividend Type']}
+
+
+def datatype_of(value):
+    if isinstance(value, list):
+        return datatype_of(value[0]) if value else blpapi.DataType.SEQUENCE
+    if isinstance(value, dict):
+        return blpapi.DataType.SEQUENCE
+    if isinstance(value, bool):
+        return blpapi.DataType.BOOL
+    if isinstance(value, int):
+        return blpapi.DataType.INT64
+    if isinstance(value, float):
+        return blpapi.DataType.FLOAT64
+    if isinstance(value, datetime.datetime):
+        return blpapi.DataType.DATETIME
+    if isinstance(value, datetime.date):
+        return blpapi.DataType.DATE
+    return blpapi.DataType.STRING
+
+
+class FakeElement():
+
+    '''
+    blpapi.Element built on python data: dict for a sequence, list for an array, anything else for a value
+    '''
+
+    def __init__(self, name, data):
+        self._name = str(name)
+        self._data = data
+
+    def __str__(self):
+        return '{} = {}'.format(self._name, self._data)
+
+    def name(self):
+        return blpapi.Name(self._name)
+
+    def datatype(self):
+        return datatype_of(self._data)
+
+    def isArray(self):
+        return isinstance(self._data, list)
+
+    def isComplexType(self):
+        return isinstance(self._data, dict)
+
+    def isNull(self):
+        return self._data is None
+
+    def numValues(self):
+        return len(self._data) if isinstance(self._data, list) else 1
+
+    def numElements(self):
+        return len(self._data) if isinstance(self._data, dict) else 0
+
+    def hasElement(self, name, excludeNullElements=False):
+        if not isinstance(self._data, dict) or str(name) not in self._data:
+            return False
+        return not (excludeNullElements and self._data[str(name)] is None)
+
+    def getElement(self, name):
+        if not self.hasElement(name):
+            raise blpapi.NotFoundException('Sub-element {} does not exist'.format(name), 0)
+        return FakeElement(name, self._data[str(name)])
+
+    def elements(self):
+        return [FakeElement(name, data) for name, data in self._data.items()]
+
+    def values(self):
+        return [self.getValue(index) for index in range(self.numValues())]
+
+    def getValue(self, index=0):
+        data = self._data[index] if isinstance(self._data, list) else self._data
+        return FakeElement(self._name, data) if isinstance(data, dict) else data
+
+    def getValueAsElement(self, index=0):
+        return FakeElement(self._name, self._data[index])
+
+    def getValueAsFloat(self, index=0):
+        return float(self.getValue(index))
+
+    def getValueAsInteger(self, index=0):
+        return int(self.getValue(index))
+
+    def getValueAsString(self, index=0):
+        return str(self.getValue(index))
+
+    def getValueAsDatetime(self, index=0):
+        return self.getValue(index)
+
+    def getElementValue(self, name):
+        return self.getElement(name).getValue()
+
+    def getElementAsFloat(self, name):
+        return float(self._data[str(name)])
+
+    def getElementAsInteger(self, name):
+        return int(self._data[str(name)])
+
+    def getElementAsString(self, name):
+        return str(self._data[str(name)])
+
+    def getElementAsDatetime(self, name):
+        return self._data[str(name)]
+
+    def getElementAsBool(self, name):
+        return bool(self._data[str(name)])
+
+
+class FakeMessage(FakeElement):
+
+    def __init__(self, message_type, data, correlation_id=None):
+        FakeElement.__init__(self, message_type, data)
+        self.correlation_id = correlation_id
+
+    def messageType(self):
+        return blpapi.Name(self._name)
+
+    def correlationIds(self):
+        return [self.correlation_id] if self.correlation_id is not None else []
+
+    def asElement(self):
+        return FakeElement(self._name, self._data)
+
+
+class FakeEvent():
+
+    def __init__(self, event_type, messages=()):
+        self.event_type = event_type
+        self.messages = list(messages)
+
+    def eventType(self):
+        return self.event_type
+
+    def __iter__(self):
+        return iter(self.messages)
+
+
+class FakeRequest():
+
+    '''
+    Records what is set on a request (set, append, getElement(...).appendValue/appendElement)
+    '''
+
+    def __init__(self, operation, elements=None):
+        self.operation = operation
+        self.elements = elements if elements != None else {}
+
+    def set(self, name, value):
+        self.elements[name] = value
+
+    def append(self, name, value):
+        self.elements.setdefault(name, []).append(value)
+
+    def getElement(self, name):
+        return FakeRequestElement(self.elements.setdefault(name, []))
+
+    def get(self, name, default=None):
+        return self.elements.get(name, default)
+
+
+class FakeRequestElement():
+
+    def __init__(self, values):
+        self.values = values
+
+    def appendValue(self, value):
+        self.values.append(value)
+
+    def appendElement(self):
+        self.values.append({})
+        return FakeRequestElement.Item(self.values[-1])
+
+    class Item():
+
+        def __init__(self, item):
+            self.item = item
+
+        def setElement(self, name, value):
+            self.item[name] = value
+
+
+class FakeService():
+
+    def __init__(self, name):
+        self._name = name
+
+    def name(self):
+        return self._name
+
+    def createRequest(self, operation):
+        return FakeRequest(operation)
+
+
+class FakeSession():
+
+    '''
+    Stand-in for blpapi.Session answering //blp/refdata and //blp/apiflds requests and //blp/mktdata subscriptions with generated data
+
+    tick_interval: time between two ticks of each event type in IntradayTickRequest responses
+    rows_per_message: bars/ticks/dates per PARTIAL_RESPONSE, securities per ReferenceDataRequest message
+    latency: seconds before the first event of each request is available (the requests in flight wait concurrently)
+    update_interval: seconds waited before each subscription update (as fast as possible by default)
+    eventHandler: callable(event, session) called from a dispatcher thread instead of polling nextEvent
+    bulk_rows: rows of the values of the BULK_FIELDS
+    terminate_after: the session terminates (SessionTerminated) after this many response events, to exercise the resumed requests
+    '''
+
+    def __init__(self, options=None, tick_interval=datetime.timedelta(seconds=1), rows_per_message=1000,
+                 latency=0, seed=0, update_interval=0, eventHandler=None, bulk_rows=50, terminate_after=None):
+        self.options = options
+        self.bulk_rows = bulk_rows
+        self.terminate_after = terminate_after
+        self.responses = 0  # Response events delivered so far
+        self.event_handler = eventHandler
+        self.dispatcher = None
+        self.condition = threading.Condition(threading.RLock())  # Guards the streams, notified when one is added
+        self.tick_interval = tick_interval
+        self.rows_per_message = rows_per_message
+        self.latency = latency
+        self.update_interval = update_interval
+        self.random = random.Random(seed)
+        self.streams = collections.OrderedDict()  # Correlation id value -> (ready time, generator of the events of a request)
+        self.subscriptions = collections.OrderedDict()  # Correlation id value -> (correlation id, fields)
+        self.correlation_ids = {}
+        self.started = False
+        self.next_id = 0
+
+    def start(self):
+        self.started = True
+        if self.event_handler is not None:
+            self.dispatcher = threading.Thread(target=self.dispatch, daemon=True)
+            self.dispatcher.start()
+        return True
+
+    def stop(self):
+        with self.condition:
+            self.started = False
+            self.streams.clear()
+            self.subscriptions.clear()
+            self.condition.notify_all()
+
+        if (self.dispatcher is not None) and (self.dispatcher is not threading.current_thread()):
+            self.dispatcher.join()
+        return True
+
+    def dispatch(self):
+        while self.started:
+            event = self.nextEvent(100)
+            if event.eventType() != blpapi.Event.TIMEOUT:
+                self.event_handler(event, self)
+        return None
+
+    def openService(self, name):
+        return True
+
+    def getService(self, name):
+        return FakeService(name)
+
+    def sendRequest(self, request, identity=None, correlationId=None, eventQueue=None, requestLabel=''):
+        if correlationId is None:
+            self.next_id -= 1
+            correlationId = blpapi.CorrelationId(self.next_id)
+
+        generators = {'IntradayBarRequest': self.intradaybar_messages,
+                      'IntradayTickRequest': self.intradaytick_messages,
+                      'ReferenceDataRequest': self.refdata_messages,
+                      'HistoricalDataRequest': self.histodata_messages,
+                      'FieldInfoRequest': self.fieldinfo_messages}
+
+        with self.condition:
+            self.streams[correlationId.value()] = (time.monotonic() + self.latency,
+                                                   self.events(generators[request.operation](request), correlationId))
+            self.correlation_ids[correlationId.value()] = correlationId
+            self.condition.notify()
+        return correlationId
+
+    def cancel(self, correlationId):
+        with self.condition:
+            self.streams.pop(correlationId.value(), None)
+        return None
+
+    def subscribe(self, subscriptionList, identity=None, requestLabel=''):
+        for i in range(subscriptionList.size()):
+            correlation_id = subscriptionList.correlationIdAt(i)
+            topic = subscriptionList.topicStringAt(i)
+
+            # e.g. IBM US Equity?fields=BID,ASK&interval=1.0
+            fields = []
+            if '?' in topic:
+                for option in topic.split('?', 1)[1].split('&'):
+                    if option.startswith('fields='):
+                        fields = option[len('fields='):].split(',')
+
+            with self.condition:
+                self.subscriptions[correlation_id.value()] = (correlation_id, fields)
+                self.condition.notify()
+        return None
+
+    def unsubscribe(self, subscriptionList):
+        with self.condition:
+            for i in range(subscriptionList.size()):
+                self.subscriptions.pop(subscriptionList.correlationIdAt(i).value(), None)
+        return None
+
+    def events(self, messages, correlation_id):
+        previous = None
+        for message_type, data in messages:
+            if previous is not None:
+                yield FakeEvent(blpapi.Event.PARTIAL_RESPONSE, [FakeMessage(previous[0], previous[1], correlation_id)])
+            previous = (message_type, data)
+
+        yield FakeEvent(blpapi.Event.RESPONSE, [FakeMessage(previous[0], previous[1], correlation_id)])
+
+    def nextEvent(self, timeout=0):
+        with self.condition:
+            event = self.next_event()
+            if event is None:
+                # Nothing to deliver, wait for a request or a response until the timeout elapses like a session would
+                wait = timeout / 1000.0
+                if self.streams:
+                    wait = min(wait, max(0, min(ready for ready, stream in self.streams.values()) - time.monotonic()))
+                self.condition.wait(wait)
+                event = self.next_event()
+        return event if event is not None else FakeEvent(blpapi.Event.TIMEOUT)
+
+    def tryNextEvent(self):
+        with self.condition:
+            return self.next_event()
+
+    def next_event(self):
+        if (self.terminate_after is not None) and (self.responses >= self.terminate_after) and self.started:
+            # Drop the requests in flight like a lost connection would
+            self.started = False
+            self.streams.clear()
+            self.subscriptions.clear()
+            return FakeEvent(blpapi.Event.SESSION_STATUS, [FakeMessage('SessionTerminated', {})])
+
+        # The requests in flight are served in turn, one event each
+        now = time.monotonic()
+        for key in list(self.streams):
+            ready, stream = self.streams.pop(key)
+            if ready > now:
+                self.streams[key] = (ready, stream)
+                continue
+            event = next(stream, None)
+            if event is not None:
+                self.streams[key] = (ready, stream)
+                self.responses += 1
+                return event
+
+        # The subscriptions are updated in turn, one message each
+        if self.subscriptions:
+            if self.update_interval:
+                time.sleep(self.update_interval)
+            key = next(iter(self.subscriptions))
+            self.subscriptions.move_to_end(key)
+            correlation_id, fields = self.subscriptions[key]
+            data = {field: self.price() for field in fields}
+            return FakeEvent(blpapi.Event.SUBSCRIPTION_DATA, [FakeMessage('MarketDataEvents', data, correlation_id)])
+
+        return None
+
+    #***************************
+    # Generated responses
+    #***************************
+
+    def chunks(self, rows):
+        for i in range(0, max(len(rows), 1), self.rows_per_message):
+            yield rows[i:i + self.rows_per_message]
+
+    def price(self):
+        return round(100 + self.random.gauss(0, 1), 2)
+
+    def intradaybar_messages(self, request):
+        interval = datetime.timedelta(minutes=request.get('interval'))
+        rows = []
+        time_bar = request.get('startDateTime')
+        while time_bar < request.get('endDateTime'):
+            open, close = self.price(), self.price()
+            volume = self.random.randint(1, 10000)
+            rows.append({'time': time_bar, 'open': open, 'high': max(open, close) + 0.01,
+                         'low': min(open, close) - 0.01, 'close': close, 'volume': volume,
+                         'numEvents': self.random.randint(1, 100), 'value': int(volume * close)})
+            time_bar += interval
+
+        for chunk in self.chunks(rows):
+            yield 'IntradayBarResponse', {'barData': {'eidData': [], 'barTickData': chunk}}
+
+    def intradaytick_messages(self, request):
+        extra_columns = ['conditionCodes'] if request.get('includeConditionCodes') else []
+        for name, value in request.elements.items():
+            if name.startswith('include') and name != 'includeConditionCodes' and value:
+                extra_columns.append(name[7:8].lower() + name[8:])
+
+        rows = []
+        time_tick = request.get('startDateTime')
+        while time_tick < request.get('endDateTime'):
+            for event in request.get('eventTypes', []):
+                row = {'time': time_tick, 'type': event, 'value': self.price(), 'size': self.random.randint(1, 1000)}
+                for extra_col in extra_columns:
+                    row[extra_col] = 'R6' if extra_col == 'conditionCodes' else 'X'
+                rows.append(row)
+            time_tick += self.tick_interval
+
+        for chunk in self.chunks(rows):
+            yield 'IntradayTickResponse', {'tickData': {'eidData': [], 'tickData': chunk}}
+
+    def refdata_messages(self, request):
+        rows = []
+        for sequence_number, ticker in enumerate(request.get('securities', [])):
+            rows.append({'security': ticker, 'eidData': [], 'fieldExceptions': [], 'sequenceNumber': sequence_number,
+                         'fieldData': {field: self.field_value(field) for field in request.get('fields', [])}})
+
+        for chunk in self.chunks(rows):
+            yield 'ReferenceDataResponse', {'securityData': chunk}
+
+    def field_value(self, field):
+        if field.upper() not in BULK_FIELDS:
+            return self.price()
+
+        rows = []
+        for i in range(self.bulk_rows):
+            row = {}
+            for name in BULK_FIELDS[field.upper()]:
+                if name.endswith('Date'):
+                    row[name] = datetime.date(2018, 1, 1) + datetime.timedelta(days=i)
+                elif name == 'Dividend Amount':
+                    row[name] = self.price() / 100
+                else:
+                    row[name] = '{} {}'.format(name.split()[0].upper(), i)
+            rows.append(row)
+        return rows
+
+    def histodata_messages(self, request):
+        start = datetime.datetime.strptime(request.get('startDate'), '%Y%m%d').date()
+        end = datetime.datetime.strptime(request.get('endDate'), '%Y%m%d').date()
+
+        # One message per security (and per chunk of dates)
+        for sequence_number, ticker in enumerate(request.get('securities', [])):
+            rows = []
+            date = start
+            while date <= end:
+                if date.weekday() < 5:
+                    row = {'date': date}
+                    for field in request.get('fields', []):
+                        row[field] = self.price()
+                    rows.append(row)
+                date += datetime.timedelta(days=1)
+
+            for chunk in self.chunks(rows):
+                yield 'HistoricalDataResponse', {'securityData': {'security': ticker, 'eidData': [], 'sequenceNumber': sequence_number,
+                                                                  'fieldExceptions': [], 'fieldData': chunk}}
+
+    def fieldinfo_messages(self, request):
+        # Every field is a price except the BULK_FIELDS
+        rows = []
+        for field in request.get('id', []):
+            if field.upper() in BULK_FIELDS:
+                datatype, ftype = 'Sequence', 'Bulk Format'
+            else:
+                datatype, ftype = 'Double', 'Price'
+            rows.append({'id': field, 'fieldInfo': {'mnemonic': field.upper(), 'datatype': datatype, 'ftype': ftype,
+                                                    'description': field}})
+
+        yield 'fieldResponse', {'fieldData': rows}
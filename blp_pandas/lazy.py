@@ -0,0 +1,64 @@
+import importlib
+import importlib.util
+import threading
+import types
+
+__doc__ = """
+Heavy dependencies (blpapi, pandas, numpy, pyarrow) imported on first use so that importing blp_pandas is cheap
+
+from .lazy import lazy_import
+
+np = lazy_import('numpy')  # numpy is imported by the first np.<attribute>
+"""
+
+
+class LazyModule(types.ModuleType):
+
+    '''
+    Stands for a module until one of its attributes is used, the module is then imported (once, thread-safe)
+    and the attributes looked up are kept on the LazyModule so that the next lookups are plain attribute lookups
+    '''
+
+    def __init__(self, name):
+        types.ModuleType.__init__(self, name)
+        self.__dict__['_lock'] = threading.Lock()
+        self.__dict__['_module'] = None
+
+    def __getattr__(self, attr):
+        # Only called for the attributes not looked up yet
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self.__dict__['_module'] = importlib.import_module(self.__name__)
+        value = getattr(self._module, attr)
+        self.__dict__[attr] = value
+        return value
+
+
+def lazy_import(name):
+    '''
+    LazyModule of name, ImportError is raised right away if the module is not installed
+    '''
+    if importlib.util.find_spec(name) is None:
+        raise ImportError("No module named '{}'".format(name), name=name)
+    return LazyModule(name)
+
+
+class LazyName():
+
+    '''
+    Class attribute holding blpapi.Name(name), created on first use and shared by all the instances of the class:
+    the descriptor replaces itself with the Name so that the next lookups are plain class attribute lookups
+    '''
+
+    def __init__(self, name):
+        self.name = name
+
+    def __set_name__(self, owner, attr):
+        self.owner = owner
+        self.attr = attr
+
+    def __get__(self, instance, owner):
+        value = importlib.import_module('blpapi').Name(self.name)
+        setattr(self.owner, self.attr, value)
+        return value
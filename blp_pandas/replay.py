@@ -0,0 +1,193 @@
+import gzip
+import pickle
+from .fake import FakeEvent, FakeMessage, FakeService
+from .lazy import lazy_import
+
+blpapi = lazy_import('blpapi')
+
+__doc__ = """
+Record the events received by BLP.eventLoop and replay them offline at disk speed
+
+from blp_pandas import blp_pandas as bbg
+from blp_pandas.replay import ReplaySession
+
+bloomberg = bbg.BLP(record='pull.blplog')        # live pull, every event is appended to pull.blplog
+df = bloomberg.get_intradaytick(...)
+
+bloomberg = bbg.BLP(session_factory=lambda options: ReplaySession('pull.blplog'))
+df = bloomberg.get_intradaytick(...)              # same calls, same result, no terminal
+
+The log is a gzip stream of pickled records, arrays of sequences (bars, ticks, dates...) are stored as
+a list of element names and a list of value tuples.
+"""
+
+ROWS = 'rows'  # Marker of an array of sequences stored column names first
+
+
+def element_to_py(element):
+    '''
+    Python data of a blpapi.Element: dict for a sequence, list for an array, value otherwise
+    '''
+    if element.isNull():
+        return None
+
+    if element.isArray():
+        values = [value_to_py(value) for value in element.values()]
+        if values and all(type(value) == dict for value in values):
+            names = list(values[0])
+            if all(list(value) == names for value in values):
+                return (ROWS, names, [tuple(value.values()) for value in values])
+        return values
+
+    if element.isComplexType():
+        return {str(sub_element.name()): element_to_py(sub_element) for sub_element in element.elements()}
+
+    return element.getValue()
+
+
+def value_to_py(value):
+    # Values of an array are either elements (complex types) or python values
+    if hasattr(value, 'isArray'):
+        return element_to_py(value)
+    return value
+
+
+def py_to_data(data):
+    # Inverse of the ROWS compaction so that the data can be wrapped into fake elements
+    if type(data) == tuple and len(data) == 3 and data[0] == ROWS:
+        names = data[1]
+        return [dict(zip(names, [py_to_data(value) for value in row])) for row in data[2]]
+    if type(data) == dict:
+        return {name: py_to_data(value) for name, value in data.items()}
+    if type(data) == list:
+        return [py_to_data(value) for value in data]
+    return data
+
+
+class Recorder():
+
+    '''
+    Appends ('request', correlation id) and ('event', event type, messages) records to a log file
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.file = gzip.open(path, 'ab')
+
+    def record_request(self, correlation_id):
+        pickle.dump(('request', correlation_id.value()), self.file, protocol=pickle.HIGHEST_PROTOCOL)
+        return None
+
+    def record_event(self, event):
+        messages = []
+        for msg in event:
+            correlation_ids = [correlation_id.value() for correlation_id in msg.correlationIds()]
+            messages.append((str(msg.messageType()), correlation_ids, element_to_py(msg.asElement())))
+
+        pickle.dump(('event', event.eventType(), messages), self.file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.file.flush()
+        return None
+
+    def close(self):
+        self.file.close()
+        return None
+
+
+class ReplaySession():
+
+    '''
+    Session feeding the events of a log back through BLP, the n-th request sent is given the events of the n-th request recorded
+    An event is only delivered once the requests it belongs to have been sent again
+    '''
+
+    def __init__(self, path, options=None):
+        self.path = path
+        self.options = options
+        self.records = None
+        self.recorded_requests = []  # Recorded correlation id values in the order the requests were sent
+        self.mapping = {}  # Recorded correlation id value -> correlation id of the replayed request
+        self.buffer = []  # Events read from the log that cannot be delivered yet
+        self.completed = set()  # Recorded correlation id values whose final event has been delivered
+        self.sent = 0
+
+    def read_records(self):
+        with gzip.open(self.path, 'rb') as f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    return
+
+    def start(self):
+        self.records = self.read_records()
+        return True
+
+    def stop(self):
+        if self.records is not None:
+            self.records.close()
+        return True
+
+    def openService(self, name):
+        return True
+
+    def getService(self, name):
+        return FakeService(name)
+
+    def cancel(self, correlationId):
+        return None
+
+    def sendRequest(self, request, identity=None, correlationId=None, eventQueue=None, requestLabel=''):
+        if correlationId is None:
+            correlationId = blpapi.CorrelationId(-1 - self.sent)
+
+        # The recorded requests are read until the n-th one (events read on the way are kept for later)
+        while len(self.recorded_requests) <= self.sent:
+            record = next(self.records, None)
+            if record is None:
+                raise ValueError('The log {} has fewer requests than the ones replayed'.format(self.path))
+            self.read(record)
+
+        self.mapping[self.recorded_requests[self.sent]] = correlationId
+        self.sent += 1
+        return correlationId
+
+    def read(self, record):
+        if record[0] == 'request':
+            self.recorded_requests.append(record[1])
+        else:
+            self.buffer.append(record)
+        return None
+
+    def deliverable(self, record):
+        return all(value in self.mapping for _, correlation_ids, _ in record[2] for value in correlation_ids)
+
+    def nextEvent(self, timeout=0):
+        for i, record in enumerate(self.buffer):
+            if self.deliverable(record):
+                del self.buffer[i]
+                return self.event(record)
+
+        for record in self.records:
+            self.read(record)
+            if (record[0] == 'event') and self.deliverable(record):
+                self.buffer.pop()
+                return self.event(record)
+
+        # The log is over, waiting for the events of the replayed requests still pending would never end
+        missing = [correlation_id.value() for value, correlation_id in self.mapping.items() if value not in self.completed]
+        if missing:
+            raise ValueError('The log {} has no more events for the replayed requests {}'.format(self.path, missing))
+        return FakeEvent(blpapi.Event.TIMEOUT)
+
+    def tryNextEvent(self):
+        return None  # The log only holds the events of the requests
+
+    def event(self, record):
+        _, event_type, messages = record
+        if event_type in (blpapi.Event.RESPONSE, blpapi.Event.REQUEST_STATUS):
+            self.completed.update(value for _, correlation_ids, _ in messages for value in correlation_ids)
+        list_messages = []
+        for message_type, correlation_ids, data in messages:
+            correlation_id = self.mapping[correlation_ids[0]] if correlation_ids else None
+            list_messages.append(FakeMessage(message_type, py_to_data(data), correlation_id))
+        return FakeEvent(event_type, list_messages)
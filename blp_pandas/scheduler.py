@@ -0,0 +1,155 @@
+import contextlib
+import contextvars
+import threading
+import time
+
+__doc__ = """
+Process-wide scheduler of the requests sent by every BLP object, and so by every entry point
+
+from blp_pandas import blp_pandas as bbg
+from blp_pandas import scheduler
+
+bbg.scheduler = scheduler.RequestScheduler(max_in_flight=8, points_per_second=2000, burst=100000)
+
+with scheduler.priority('batch'):
+    df = bbg.HistoData(universe, fields, start_date, end_date)  # Only uses the capacity left by the interactive requests
+
+A request is sent once a slot is free, the token bucket holds its data points and no request of a higher priority
+is waiting. When the server pushes back (LIMIT errors) the slots are halved and the requests are held back.
+"""
+
+PRIORITIES = ('interactive', 'batch')  # Highest priority first
+
+current_priority = contextvars.ContextVar('priority', default='interactive')
+
+
+def check_priority(value):
+    if value not in PRIORITIES:
+        raise ValueError('The priority has to be one of {}'.format(', '.join(PRIORITIES)))
+    return None
+
+
+@contextlib.contextmanager
+def priority(value):
+    '''
+    Priority of the requests sent in the block (in the current thread or task)
+    '''
+    check_priority(value)
+    token = current_priority.set(value)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+
+class RequestScheduler():
+
+    '''
+    max_in_flight: requests outstanding at the same time across all the sessions
+    points_per_second/burst: token bucket on the data points of the requests (no limit by default), a request larger
+    than burst waits for a full bucket
+    backoff/max_backoff: when a request fails with a LIMIT error, the slots are halved and no request is sent for
+    backoff seconds, doubled on each push back up to max_backoff. The slots come back one by one as requests succeed.
+    '''
+
+    def __init__(self, max_in_flight=16, points_per_second=None, burst=None, backoff=1.0, max_backoff=60.0):
+        self.max_in_flight = max_in_flight
+        self.limit = max_in_flight  # Slots currently allowed, lowered when the server pushes back
+        self.in_flight = 0
+        self.points_per_second = points_per_second
+        self.burst = burst if burst != None else points_per_second
+        self.tokens = self.burst
+        self.refilled_at = time.monotonic()
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.delay = 0.0  # Current backoff
+        self.resume_at = 0.0
+        self.waiting = dict.fromkeys(PRIORITIES, 0)
+        self.listeners = []  # Callables called after each release, see add_listener
+        self.condition = threading.Condition()
+
+    def wait_time(self, points, priority, now):
+        '''
+        Must be called with the condition held, seconds before the request can be sent (0 if it can be sent now)
+        or None if it has to wait for a release
+        '''
+        if any(self.waiting[higher] for higher in PRIORITIES[:PRIORITIES.index(priority)]):
+            return None
+        if self.in_flight >= self.limit:
+            return None
+        if now < self.resume_at:
+            return self.resume_at - now
+
+        if self.points_per_second != None:
+            self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.points_per_second)
+            self.refilled_at = now
+            if self.tokens < min(points, self.burst):
+                return (min(points, self.burst) - self.tokens) / self.points_per_second
+
+        return 0
+
+    def acquire(self, points=1, priority='interactive', blocking=True):
+        '''
+        Take a slot for a request of points data points, returns False if blocking is False and it cannot be sent now
+        '''
+        with self.condition:
+            if blocking:
+                self.waiting[priority] += 1
+            try:
+                while True:
+                    wait = self.wait_time(points, priority, time.monotonic())
+                    if wait == 0:
+                        self.in_flight += 1
+                        if self.points_per_second != None:
+                            self.tokens -= min(points, self.burst)
+                        return True
+                    if not blocking:
+                        return False
+                    self.condition.wait(wait)
+            finally:
+                if blocking:
+                    self.waiting[priority] -= 1
+                    self.condition.notify_all()
+
+    def release(self, throttled=False):
+        '''
+        Give the slot of a request back once it is over, throttled if it failed with a LIMIT error
+        '''
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                self.delay = min(self.max_backoff, self.delay * 2 if self.delay else self.backoff)
+                self.resume_at = time.monotonic() + self.delay
+                self.limit = max(1, self.limit // 2)
+            else:
+                self.delay = self.delay / 2 if self.delay > self.backoff else 0.0
+                self.limit = min(self.max_in_flight, self.limit + 1)
+            self.condition.notify_all()
+            listeners = list(self.listeners)
+
+        for callback in listeners:
+            callback()
+        return None
+
+    def time_to_slot(self, points=1, priority='interactive'):
+        '''
+        Seconds before a request of points data points can take a slot (0 if it can now), None if it has to wait for a release
+        '''
+        with self.condition:
+            return self.wait_time(points, priority, time.monotonic())
+
+    def add_listener(self, callback):
+        '''
+        callback() is called (outside the lock) after each release, e.g. to send the requests that could not take a slot
+        without blocking (acquire(..., blocking=False)), see aio.AsyncBLP
+        '''
+        with self.condition:
+            if callback not in self.listeners:
+                self.listeners.append(callback)
+        return None
+
+    def remove_listener(self, callback):
+        with self.condition:
+            if callback in self.listeners:
+                self.listeners.remove(callback)
+        return None
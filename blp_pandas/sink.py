@@ -0,0 +1,193 @@
+import collections
+import os
+import urllib.parse
+import uuid
+from .lazy import lazy_import
+
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
+
+try:
+    pa = lazy_import('pyarrow')
+except ImportError:
+    pa = None
+
+__doc__ = """
+Writes the results of the entry points straight into partitioned Parquet or Arrow IPC files (requires pyarrow,
+pip install blp_pandas[sink])
+
+from blp_pandas import blp_pandas as bbg
+
+files = bbg.IntradayTick(universe, ['TRADE'], datetime(2018,11,22,9,0), datetime(2018,11,22,17,30), sink='/data/ticks')
+
+df = pd.read_parquet('/data/ticks')  # ticker and date come back as columns from the directory names
+
+The intraday pulls are streamed into the sink chunk by chunk so that archiving a whole universe runs in constant memory.
+"""
+
+FORMATS = {'parquet': 'parquet', 'arrow': 'arrow'}  # Format -> file extension
+PARTITIONS = ('ticker', 'date', 'month', 'year')
+
+
+def check_sink(value):
+    if (value != None) and (type(value) != str) and (not isinstance(value, Sink)):
+        raise ValueError('The sink has to be a directory path or a Sink')
+    return None
+
+
+class Sink():
+
+    '''
+    Writes the frames handed to write() into Parquet (format='parquet') or Arrow IPC (format='arrow') files
+    partitioned like path/ticker=<ticker>/date=<YYYY-MM-DD>/<part>.parquet
+
+    partition_by: ticker and/or a period (date, month or year) of the time or date of the rows, the partition columns
+    are not stored in the files (they are read back from the directory names)
+    buffer_rows: rows buffered in total before they are written as a row group (record batch) to each partition
+    max_open_files: files kept open at the same time, a partition written again once its file is closed gets a new file
+
+    Each file is written under a temporary name and renamed once closed, close() returns the files written.
+    '''
+
+    def __init__(self, path, format='parquet', partition_by=('ticker', 'date'), buffer_rows=100000, max_open_files=64):
+        if pa is None:
+            raise ImportError('The sink requires pyarrow (pip install blp_pandas[sink])')
+        if format not in FORMATS:
+            raise ValueError('The format has to be one of {}'.format(', '.join(FORMATS)))
+        if any(name not in PARTITIONS for name in partition_by):
+            raise ValueError('The partitions have to be among {}'.format(', '.join(PARTITIONS)))
+
+        self.path = path
+        self.format = format
+        self.partition_by = list(partition_by)
+        self.buffer_rows = buffer_rows
+        self.max_open_files = max_open_files
+        self.run_id = uuid.uuid4().hex[:12]  # Files of different runs never overwrite each other
+
+        self.buffers = collections.OrderedDict()  # Partition -> list of frames not written yet
+        self.buffered = 0
+        self.writers = collections.OrderedDict()  # Partition -> (writer, schema, tmp path, path), least recently used first
+        self.parts = collections.Counter()  # Partition -> files opened so far
+        self.files = []
+        self.rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def partition_keys(self, df_long):
+        # (name, values) of each partition of the rows, the periods are taken from the time (or date) column
+        keys = []
+        for name in self.partition_by:
+            if name in df_long.columns:
+                keys.append((name, df_long[name].to_numpy()))
+            elif name != 'ticker':
+                column = 'time' if 'time' in df_long.columns else 'date' if 'date' in df_long.columns else None
+                if column is not None:
+                    unit = {'date': 'D', 'month': 'M', 'year': 'Y'}[name]
+                    periods = pd.to_datetime(df_long[column]).to_numpy().astype('datetime64[{}]'.format(unit))
+                    keys.append((name, periods.astype(str)))  # e.g. 2018-11-22, 2018-11 or 2018
+        return keys
+
+    def write(self, df_buffer):
+        '''
+        Buffer the rows of a frame returned by an entry point (or a chunk of a stream) in their partitions
+        '''
+        if not len(df_buffer):
+            return None
+
+        df_long = df_buffer.reset_index() if any(df_buffer.index.names) else df_buffer
+        keys = self.partition_keys(df_long)
+        stored = [name for name, values in keys if name in df_long.columns]
+
+        if keys:
+            groups = df_long.groupby([values for name, values in keys], sort=False)
+        else:
+            groups = [((), df_long)]
+
+        for values, df_part in groups:
+            values = values if type(values) == tuple else (values,)
+            partition = tuple((name, str(value)) for (name, _), value in zip(keys, values))
+            self.buffers.setdefault(partition, []).append(df_part.drop(columns=stored))
+            self.buffered += len(df_part)
+
+        if self.buffered >= self.buffer_rows:
+            self.flush()
+        return None
+
+    def to_table(self, df_buffer):
+        # The categorical columns are stored as strings and the integers as int64 so that every chunk has the same schema
+        columns = {}
+        for column in df_buffer.columns:
+            values = df_buffer[column]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.astype(object)
+            elif values.dtype.kind in 'iu':
+                values = values.astype(np.int64)
+            columns[column] = values
+        table = pa.Table.from_pandas(pd.DataFrame(columns), preserve_index=False)
+
+        # A column holding only missing values (e.g. no condition codes in the first chunk) is inferred as null, which
+        # could not hold the values of the next chunks: it is typed as string like the categorical columns
+        for i, field in enumerate(table.schema):
+            if pa.types.is_null(field.type):
+                table = table.set_column(i, pa.field(field.name, pa.string()), pa.nulls(table.num_rows, pa.string()))
+        return table
+
+    def flush(self):
+        '''
+        Write the buffered rows of every partition
+        '''
+        for partition, list_df_buffer in self.buffers.items():
+            table = self.to_table(pd.concat(list_df_buffer, ignore_index=True))
+            writer, schema = self.writer(partition, table.schema)
+            writer.write_table(table.cast(schema))
+            self.rows += table.num_rows
+        self.buffers.clear()
+        self.buffered = 0
+        return None
+
+    def writer(self, partition, schema):
+        # Writer of the current file of a partition, the least recently used file is closed if too many are open
+        if partition in self.writers:
+            self.writers.move_to_end(partition)
+            writer, schema, tmp_path, file_path = self.writers[partition]
+            return writer, schema
+
+        if len(self.writers) >= self.max_open_files:
+            self.close_writer(next(iter(self.writers)))
+
+        directory = os.path.join(self.path, *['{}={}'.format(name, urllib.parse.quote(value, safe=''))
+                                              for name, value in partition])
+        os.makedirs(directory, exist_ok=True)
+        file_path = os.path.join(directory, '{}-{}.{}'.format(self.run_id, self.parts[partition], FORMATS[self.format]))
+        tmp_path = file_path + '.tmp'
+        self.parts[partition] += 1
+
+        if self.format == 'parquet':
+            import pyarrow.parquet as pq
+            writer = pq.ParquetWriter(tmp_path, schema)
+        else:
+            writer = pa.ipc.new_file(tmp_path, schema)
+
+        self.writers[partition] = (writer, schema, tmp_path, file_path)
+        return writer, schema
+
+    def close_writer(self, partition):
+        writer, schema, tmp_path, file_path = self.writers.pop(partition)
+        writer.close()
+        os.replace(tmp_path, file_path)
+        self.files.append(file_path)
+        return None
+
+    def close(self):
+        '''
+        Write the rows still buffered and close the files, returns the paths of the files written
+        '''
+        self.flush()
+        for partition in list(self.writers):
+            self.close_writer(partition)
+        return self.files
@@ -0,0 +1,105 @@
+import logging
+import time
+
+__doc__ = """
+Per-request instrumentation of the BLP.get_* methods
+
+Each result carries the stats of the request that produced it in df.attrs['stats'] and the stats of every request
+are handed to the callbacks registered with add_callback, e.g. to export them to a monitoring system:
+
+from blp_pandas import stats
+
+stats.add_callback(lambda request_stats: statsd.gauge_many(request_stats.as_dict()))
+stats.add_callback(stats.log_stats)  # Logged on the 'blp_pandas' logger
+"""
+
+logger = logging.getLogger('blp_pandas')
+
+PHASES = ('session_start', 'open_service', 'scheduling', 'server_latency', 'decode', 'assembly', 'total')
+
+callbacks = []
+
+
+class RequestStats():
+
+    '''
+    Timings in seconds per phase and counts of one call of a BLP.get_* method
+    session_start: starting the session (only for the first request of a session)
+    open_service: opening the services (only the first time on a session)
+    scheduling: waiting for the scheduler to let the requests go, see scheduler.py
+    server_latency: from the first request sent to the first response event received
+    decode: time spent in the process_msg_* decoders
+    assembly: building the dataframe from the decoded data
+    '''
+
+    def __init__(self, request_type=None):
+        self.request_type = request_type
+        self.timings = dict.fromkeys(PHASES, 0.0)
+        self.requests = 0
+        self.events = 0
+        self.messages = 0
+        self.rows = 0
+        self.elements = 0
+        self.bytes = 0
+        self.started_at = time.perf_counter()
+        self.sent_at = None
+
+    def __repr__(self):
+        return 'RequestStats({})'.format(', '.join('{}={}'.format(k, v) for k, v in self.as_dict().items()))
+
+    def add(self, phase, seconds):
+        self.timings[phase] += seconds
+        return None
+
+    def as_dict(self):
+        '''
+        Flat dictionary of the stats (timings suffixed with _seconds), ready to be exported
+        '''
+        dict_stats = {'request_type': self.request_type}
+        for phase in PHASES:
+            dict_stats[phase + '_seconds'] = self.timings[phase]
+        for count in ('requests', 'events', 'messages', 'rows', 'elements', 'bytes'):
+            dict_stats[count] = getattr(self, count)
+        return dict_stats
+
+    @staticmethod
+    def merge(list_stats):
+        # Stats of several requests added together (e.g. one request per ticker)
+        merged = RequestStats()
+        for request_stats in list_stats:
+            if request_stats is None:
+                continue
+            merged.request_type = request_stats.request_type
+            for phase in PHASES:
+                merged.timings[phase] += request_stats.timings[phase]
+            for count in ('requests', 'events', 'messages', 'rows', 'elements', 'bytes'):
+                setattr(merged, count, getattr(merged, count) + getattr(request_stats, count))
+        return merged
+
+
+def add_callback(callback):
+    '''
+    callback(request_stats) is called at the end of every request
+    '''
+    callbacks.append(callback)
+    return None
+
+
+def remove_callback(callback):
+    callbacks.remove(callback)
+    return None
+
+
+def publish(request_stats):
+    # A failing callback must not fail the request
+    for callback in list(callbacks):
+        try:
+            callback(request_stats)
+        except Exception as e:
+            logger.warning('Stats callback %s failed: %s', callback, e)
+    return None
+
+
+def log_stats(request_stats):
+    logger.info('%s', request_stats.as_dict())
+    return None
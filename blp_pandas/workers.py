@@ -0,0 +1,358 @@
+import concurrent.futures
+import datetime
+import functools
+import itertools
+import math
+from multiprocessing import resource_tracker, shared_memory
+from . import blp_pandas as bbg
+from .lazy import lazy_import
+from .scheduler import current_priority
+from .stats import RequestStats
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+__doc__ = """
+Process pool versions of IntradayBar, IntradayTick and HistoData, the decoding of large backfills is spread over several cores
+
+from blp_pandas import workers
+
+df = workers.IntradayTick(universe, ['TRADE'], datetime(2018,11,22,9,0), datetime(2018,11,22,17,30), processes=8)
+
+Each worker process keeps its own Bloomberg session between calls and pulls a share of the tickers (or of the date range
+when there are fewer tickers than processes). The columns it decodes are copied into shared memory blocks and the parent
+assembles the final frame from them: only the names of the blocks and the categories are pickled, not the dataframes.
+Each job holds at least one slot of the scheduler of the parent (bbg.scheduler) and is charged its data points, it sends at most one request per slot it holds, the workers have no scheduler of their own.
+"""
+
+
+pool = None  # ProcessPoolExecutor shared by the calls, started by the first call
+pool_processes = 0
+
+
+def check_processes(value):
+    if (type(value) != int) or (value < 1):
+        raise ValueError('The processes parameter has to be an integer greater than 1')
+    return None
+
+
+def get_pool(processes):
+    global pool, pool_processes
+    if (pool is None) or (pool_processes != processes):
+        shutdown()
+        pool = concurrent.futures.ProcessPoolExecutor(processes, initializer=init_worker,
+                                                      initargs=(bbg.session_pool.session_options,
+                                                                bbg.session_pool.session_factory,
+                                                                bbg.session_pool.wait))
+        pool_processes = processes
+    return pool
+
+
+def shutdown():
+    '''
+    Stop the worker processes (and their sessions), the next call starts new ones
+    '''
+    global pool
+    if pool is not None:
+        pool.shutdown()
+        pool = None
+    return None
+
+
+def init_worker(session_options, session_factory, wait):
+    # The sessions and the scheduler inherited from the parent are not used by the worker, the parent holds the slots of its jobs
+    bbg.session_pool = bbg.SessionPool(1, session_options, session_factory, wait)
+    bbg.scheduler = None
+    return None
+
+
+#***************************
+# Shared memory
+#***************************
+
+def share_array(values):
+    # Copy of values in a new shared memory block, returns (block name, dtype, size), the parent unlinks the block
+    block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+    resource_tracker.unregister(block._name, 'shared_memory')  # Owned by the parent from now on
+
+    shared = np.ndarray(values.shape, dtype=values.dtype, buffer=block.buf)
+    shared[:] = values
+    del shared
+
+    block.close()
+    return (block.name, values.dtype.str, len(values))
+
+
+def share_frame(df_buffer):
+    '''
+    The index levels and the columns of df_buffer copied into shared memory, the categorical and the object columns
+    are stored as int32 codes (-1 for the missing values) and their categories are sent along with the block names
+    '''
+    df_long = df_buffer.reset_index()
+
+    columns = []
+    for name in df_long.columns:
+        values = df_long[name]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            columns.append((name, 'category', share_array(values.cat.codes.to_numpy(np.int32)), list(values.cat.categories)))
+        elif values.dtype.kind in 'biufmM':
+            columns.append((name, 'array', share_array(values.to_numpy()), None))
+        else:
+            codes, uniques = pd.factorize(values)
+            columns.append((name, 'object', share_array(codes.astype(np.int32)), list(uniques)))
+
+    return {'index': list(df_buffer.index.names), 'columns': columns, 'stats': df_buffer.attrs.get('stats'),
+            'failed': df_buffer.attrs.get('failed', [])}
+
+
+def concat_shared(list_array, list_mapping=None):
+    '''
+    Concatenation of the shared arrays (block name, dtype, size) in a new array, the codes of the i-th array are
+    translated with list_mapping[i] if given. The blocks are unlinked once copied.
+    '''
+    blocks, views = [], []
+    try:
+        for name, dtype, size in list_array:
+            blocks.append(shared_memory.SharedMemory(name=name))
+            views.append(np.ndarray(size, dtype=np.dtype(dtype), buffer=blocks[-1].buf))
+
+        if list_mapping is None:
+            return np.concatenate(views)
+
+        values = np.empty(sum(len(view) for view in views), dtype=np.int32)
+        start = 0
+        for view, mapping in zip(views, list_mapping):
+            np.take(mapping, view, out=values[start:start + len(view)])
+            start += len(view)
+        return values
+    finally:
+        views.clear()
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+def read_shared(column):
+    # Values of a shared column of one frame (used when the frames do not agree on its kind)
+    name, kind, array, categories = column
+    if kind == 'array':
+        return pd.Series(concat_shared([array]))
+
+    codes = concat_shared([array])
+    if kind == 'category':
+        return pd.Series(pd.Categorical.from_codes(codes, categories))
+    return pd.Series(pd.Categorical.from_codes(codes, categories)).astype(object)
+
+
+def release(shared):
+    # Unlink the blocks of a shared frame that is not assembled
+    for name, kind, array, categories in shared['columns']:
+        concat_shared([array])
+    return None
+
+
+def assemble(list_shared):
+    '''
+    Frame of the shared frames (in order), each column is copied once from the shared blocks into its final array
+    and the categories of the frames are merged
+    '''
+    data = {}
+    for j, (name, kind, array, categories) in enumerate(list_shared[0]['columns']):
+        parts = [shared['columns'][j] for shared in list_shared]
+        kinds = set(part[1] for part in parts)
+
+        if kinds == {'array'}:
+            data[name] = concat_shared([part[2] for part in parts])
+
+        elif 'array' in kinds:
+            # e.g. a column holding strings in some frames and only missing values (float) in the others
+            data[name] = pd.concat([read_shared(part) for part in parts], ignore_index=True)
+
+        else:
+            categories = list(dict.fromkeys(itertools.chain.from_iterable(part[3] for part in parts)))
+            position = {value: code for code, value in enumerate(categories)}
+            mappings = [np.array([position[value] for value in part[3]] + [-1], dtype=np.int32) for part in parts]
+            codes = concat_shared([part[2] for part in parts], mappings)
+
+            if kinds == {'category'}:
+                data[name] = pd.Categorical.from_codes(codes, categories)
+            else:
+                lookup = np.empty(len(categories) + 1, dtype=object)
+                lookup[:len(categories)] = categories
+                lookup[-1] = np.nan
+                data[name] = lookup[codes]
+
+    df_buffer = pd.DataFrame(data).set_index(list_shared[0]['index'])
+    df_buffer.attrs['stats'] = RequestStats.merge([shared['stats'] for shared in list_shared])
+    df_buffer.attrs['failed'] = sorted(set(itertools.chain.from_iterable(shared['failed'] for shared in list_shared)))
+    return df_buffer
+
+
+#***************************
+# Jobs
+#***************************
+
+def pull(entry_point, args, kwargs, end=None):
+    '''
+    Runs in a worker process: the frame returned by the entry point is copied into shared memory
+    The rows at or after end are dropped as they are also pulled by the job of the next part of the date range
+    '''
+    df_buffer = getattr(bbg, entry_point)(*args, **kwargs)
+    if end is not None:
+        df_buffer = df_buffer[df_buffer.index.get_level_values(0) < np.datetime64(end)]
+    return share_frame(df_buffer)
+
+
+def job_cost(entry_point, args, kwargs):
+    # Data points of a job charged to the token bucket of the scheduler, counted like BLP.costs (one per intraday request)
+    tickers, start_date, end_date = args[0], args[2], args[3]
+    if entry_point == 'HistoData':
+        fields = [args[1]] if type(args[1]) == str else args[1]
+        return len(tickers) * len(fields) * max(1, int(np.busday_count(start_date.date(), end_date.date())) + 1)
+    return len(tickers) * len(bbg.split_time_range(start_date, end_date, kwargs.get('window')))
+
+
+def release_slots(slot_scheduler, slots, future):
+    for _ in range(slots):
+        slot_scheduler.release()
+    return None
+
+
+def run(jobs, processes):
+    '''
+    jobs is a list of (entry point, args, kwargs, end) pulled by the pool, returns the frame assembled in the order of the jobs
+    When there is a bbg.scheduler a job is only submitted once it holds a slot charged with its data points, the other
+    slots it could use (max_in_flight) are only taken if they are free and the job sends at most one request per slot held.
+    The slots are released when the job is over.
+    '''
+    slot_scheduler = bbg.scheduler
+    priority = current_priority.get()
+
+    futures = []
+    for entry_point, args, kwargs, end in jobs:
+        slots = 0
+        if slot_scheduler is not None:
+            slot_scheduler.acquire(job_cost(entry_point, args, kwargs), priority)
+            slots = 1
+            while (slots < kwargs.get('max_in_flight', 1)) and slot_scheduler.acquire(0, priority, blocking=False):
+                slots += 1
+            if 'max_in_flight' in kwargs:
+                kwargs = dict(kwargs, max_in_flight=slots)
+
+        futures.append(get_pool(processes).submit(pull, entry_point, args, kwargs, end))
+        if slots:
+            futures[-1].add_done_callback(functools.partial(release_slots, slot_scheduler, slots))
+
+    list_shared, error = [], None
+    for future in futures:
+        try:
+            list_shared.append(future.result())
+        except Exception as exc:
+            error = error or exc
+
+    if error is not None:
+        for shared in list_shared:
+            release(shared)
+        raise error
+
+    return assemble(list_shared)
+
+
+def split_jobs(tickers, start_date, end_date, processes, step=None):
+    '''
+    (tickers, start, end, drop rows from) of each job: consecutive chunks of tickers or, when there are fewer tickers
+    than processes and step is given, one ticker per job with its date range split in parts (a multiple of step)
+    '''
+    if (len(tickers) >= processes) or (step == None):
+        return [(chunk, start_date, end_date, None) for chunk in bbg.split_list(tickers, math.ceil(len(tickers) / processes))]
+
+    parts = math.ceil(processes / len(tickers))
+    window = max(1, math.ceil((end_date - start_date) / step / parts)) * step
+    windows = bbg.split_time_range(start_date, end_date, window)
+
+    jobs = []
+    for ticker in tickers:
+        for window_index, (window_start, window_end) in enumerate(windows):
+            jobs.append(([ticker], window_start, window_end, window_end if window_index < len(windows) - 1 else None))
+    return jobs
+
+
+#***************************
+# Entry points
+#***************************
+
+def IntradayBar(security, event, start_date, end_date, barInterval, other_param=None, max_in_flight=1, window=None,
+                retries=0, compact=False, resume=3, processes=4):
+    '''
+    Same parameters and output as blp_pandas.IntradayBar (without stream), pulled by processes worker processes
+    '''
+    bbg.check_date_time(start_date)
+    bbg.check_date_time(end_date)
+    check_processes(processes)
+
+    if (type(barInterval) != int) or (barInterval < 1):
+        raise ValueError('The bar interval has to be an integer greater than 1')
+
+    if (type(security) != str) and (type(security) != list):
+        raise ValueError('The security parameter has to be a string or a list')
+
+    tickers = [security] if type(security) == str else security
+    kwargs = {'other_param': other_param, 'max_in_flight': max_in_flight, 'window': window, 'retries': retries,
+              'compact': compact, 'resume': resume}
+
+    jobs = [('IntradayBar', (chunk, event, start, end, barInterval), kwargs, drop_from)
+            for chunk, start, end, drop_from in split_jobs(tickers, start_date, end_date, processes,
+                                                           datetime.timedelta(minutes=barInterval))]
+    return run(jobs, processes)
+
+
+def IntradayTick(security, list_events, start_date, end_date, condition_codes=True, other_param=None, max_in_flight=1,
+                 window=None, retries=0, compact=False, resume=3, processes=4):
+    '''
+    Same parameters and output as blp_pandas.IntradayTick (without stream), pulled by processes worker processes
+    '''
+    bbg.check_date_time(start_date)
+    bbg.check_date_time(end_date)
+    check_processes(processes)
+
+    if (type(security) != str) and (type(security) != list):
+        raise ValueError('The security parameter has to be a string or a list')
+
+    tickers = [security] if type(security) == str else security
+    kwargs = {'condition_codes': condition_codes, 'other_param': other_param, 'max_in_flight': max_in_flight,
+              'window': window, 'retries': retries, 'compact': compact, 'resume': resume}
+
+    jobs = [('IntradayTick', (chunk, list_events, start, end), kwargs, drop_from)
+            for chunk, start, end, drop_from in split_jobs(tickers, start_date, end_date, processes,
+                                                           datetime.timedelta(seconds=1))]
+    return run(jobs, processes)
+
+
+def HistoData(security, fields, start_date, end_date, overrides=None, other_param=None, layout='long', compact=False,
+              field_info=None, processes=4):
+    '''
+    Same parameters and output as blp_pandas.HistoData (without cache), the tickers are split between processes worker processes
+    '''
+    bbg.check_date_time(start_date)
+    bbg.check_date_time(end_date)
+    check_processes(processes)
+
+    if (type(security) != str) and (type(security) != list):
+        raise ValueError('The security parameter has to be a string or a list')
+
+    if layout not in ('long', 'wide'):
+        raise ValueError("The layout has to be 'long' or 'wide'")
+
+    tickers = [security] if type(security) == str else security
+    kwargs = {'overrides': overrides, 'other_param': other_param, 'compact': compact, 'field_info': field_info}
+
+    # The frames are pulled in the long layout and pivoted once assembled
+    jobs = [('HistoData', (chunk, fields, start, end), kwargs, None)
+            for chunk, start, end, drop_from in split_jobs(tickers, start_date, end_date, processes)]
+    df_buffer = run(jobs, processes)
+
+    if layout == 'wide':
+        attrs = dict(df_buffer.attrs)
+        df_buffer = df_buffer.unstack('ticker')
+        df_buffer.attrs.update(attrs)
+    return df_buffer
@@ -8,6 +8,7 @@ setup(
     author_email='teddy.ambona@gmail.com',
     packages=['blp_pandas'],
     install_requires=['blpapi', 'pandas', 'numpy'],
+    extras_require={'cache': ['pyarrow'], 'sink': ['pyarrow']},
     version='0.1',
     license="""
             Copyright 2012. Bloomberg Finance L.P.